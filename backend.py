@@ -1,19 +1,32 @@
 import sqlite3
 import socket
 import threading
-import webview
 import sys
 import os
 import logging
+import logging.handlers
 import json
 import csv
 import io
 import shutil
-from flask import Flask, jsonify, request, send_from_directory, send_file, Response
+import gzip
+import uuid
+import queue
+import re
+import base64
+import time
+import functools
+import bisect
+import argparse
+from contextlib import contextmanager
+from collections import OrderedDict
+from flask import Flask, jsonify, request, send_from_directory, Response, stream_with_context, session, g, has_request_context
 from flask_cors import CORS
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+try: import brotli  # opcional: sem ele as respostas saem só em gzip
+except ImportError: brotli = None
 
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
@@ -25,44 +38,360 @@ else:
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     DATA_DIR = BASE_DIR
 
-UPLOAD_FOLDER = os.path.join(DATA_DIR, 'uploads')
-if not os.path.exists(UPLOAD_FOLDER): os.makedirs(UPLOAD_FOLDER)
+UPLOAD_FOLDER = os.path.join(DATA_DIR, 'uploads')  # criada pelo run_flask: o modo --cliente não grava nada na estação
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.secret_key = 'chave-secreta-clinica-v9-fix'
+# True: username/role viajam no cookie de sessão (já assinado pelo Flask) e o load_user não consulta usuarios.
+# Troca de papel só vale a partir do próximo login.
+app.config['SESSAO_ASSINADA'] = os.environ.get('CLINICA_SESSAO_ASSINADA') == '1'
 CORS(app, supports_credentials=True)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login_error'
 
-def obter_ip_rede():
+def obter_ip_rede(porta=5000):
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(('8.8.8.8', 80))
         ip = s.getsockname()[0]
         s.close()
-        return f"http://{ip}:5000"
+        return f"http://{ip}:{porta}"
     except:
-        return "http://127.0.0.1:5000"
+        return f"http://127.0.0.1:{porta}"
 
 class User(UserMixin):
     def __init__(self, id, username, role):
         self.id = id; self.username = username; self.role = role
 
+# --- MÉTRICAS ---
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_LENTO_MS = float(os.environ.get('CLINICA_SQL_LENTO_MS', 200))
+
+log_sql = logging.getLogger('clinica.sql'); log_sql.propagate = False
+try:
+    _h = logging.handlers.RotatingFileHandler(os.path.join(DATA_DIR, 'consultas_lentas.log'), maxBytes=2 * 1024 * 1024, backupCount=3, encoding='utf-8', delay=True)
+    _h.setFormatter(logging.Formatter('%(asctime)s %(message)s')); log_sql.addHandler(_h)
+except OSError: pass
+log_app = logging.getLogger('clinica')
+
+class Metricas:
+    """Contadores e histogramas em memória, exportados em texto Prometheus pelo /api/metrics."""
+    def __init__(self):
+        self._lock = threading.Lock(); self.requests = {}; self.latencia = {}; self.sql = {}; self.consultas = {}; self.lentas = []; self.erros = {}
+
+    def _observar(self, hist, chave, seg):
+        h = hist.get(chave)
+        if h is None: h = hist[chave] = [[0] * len(BUCKETS_LATENCIA), 0.0, 0]
+        for i, b in enumerate(BUCKETS_LATENCIA):
+            if seg <= b: h[0][i] += 1
+        h[1] += seg; h[2] += 1
+
+    def request(self, rota, metodo, status, seg):
+        with self._lock:
+            k = (rota, metodo, str(status)); self.requests[k] = self.requests.get(k, 0) + 1; self._observar(self.latencia, (rota, metodo), seg)
+
+    def consulta(self, rota, sql, seg):
+        with self._lock:
+            self._observar(self.sql, (rota,), seg)
+            c = self.consultas.get(sql)
+            if c is None:
+                if len(self.consultas) >= 500: return  # SQL montado dinamicamente não pode crescer sem limite
+                c = self.consultas[sql] = [0, 0.0, 0.0]
+            c[0] += 1; c[1] += seg; c[2] = max(c[2], seg)
+
+    def resumo_sql(self, n=30):
+        """Consultas lentas recentes (com plano) e as n que mais somam tempo."""
+        with self._lock:
+            top = sorted(({'sql': k, 'qtd': v[0], 'total_ms': round(v[1] * 1000, 1), 'max_ms': round(v[2] * 1000, 1)} for k, v in self.consultas.items()), key=lambda x: -x['total_ms'])[:n]
+            return {'lentas': list(self.lentas), 'top': top}
+
+    def lenta(self, registro):
+        with self._lock: self.lentas.append(registro); del self.lentas[:-50]
+
+    def erro(self, origem):
+        with self._lock: self.erros[origem] = self.erros.get(origem, 0) + 1
+
+    def prometheus(self):
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"')
+        def hist(nome, dados, rotulos):
+            out = [f"# TYPE {nome} histogram"]
+            for chave, (bk, soma, qtd) in sorted(dados.items()):
+                lb = ','.join(f'{r}="{esc(v)}"' for r, v in zip(rotulos, chave))
+                out += [f'{nome}_bucket{{{lb},le="{b}"}} {n}' for b, n in zip(BUCKETS_LATENCIA, bk)]
+                out += [f'{nome}_bucket{{{lb},le="+Inf"}} {qtd}', f'{nome}_sum{{{lb}}} {soma:.6f}', f'{nome}_count{{{lb}}} {qtd}']
+            return out
+        with self._lock:
+            out = ["# TYPE clinica_http_requests_total counter"]
+            out += [f'clinica_http_requests_total{{rota="{esc(r)}",metodo="{m}",status="{st}"}} {n}' for (r, m, st), n in sorted(self.requests.items())]
+            out += hist('clinica_http_request_duration_seconds', self.latencia, ('rota', 'metodo'))
+            out += hist('clinica_sql_duration_seconds', self.sql, ('rota',))
+            out += ["# TYPE clinica_erros_total counter"] + [f'clinica_erros_total{{origem="{esc(o)}"}} {n}' for o, n in sorted(self.erros.items())]
+        return '\n'.join(out) + '\n'
+
+metricas = Metricas()
+
+class CursorMedido(sqlite3.Cursor):
+    """Cronometra execute/fetch e soma no request corrente; passando de SQL_LENTO_MS, grava o SQL e o plano no log de consultas lentas.
+    Cada statement vira uma única observação (execute + fetches), fechada no próximo execute, no close() ou quando o cursor é liberado."""
+    def _medir(self, fn, *args):
+        t0 = time.perf_counter()
+        try: return fn(*args)
+        finally: self._registrar(time.perf_counter() - t0)
+
+    def _registrar(self, seg):
+        if getattr(self, '_sql', None) is None: return
+        self._seg += seg
+        if has_request_context(): g.sql_seg = g.get('sql_seg', 0.0) + seg
+        if self._seg * 1000 >= SQL_LENTO_MS and not self._logado: self._logado = True; self._log_lenta(self._rota)
+
+    def _concluir(self):
+        sql = getattr(self, '_sql', None)
+        if sql is not None: self._sql = None; metricas.consulta(self._rota, sql, self._seg)
+
+    def _log_lenta(self, rota):
+        try: plano = [r[3] for r in sqlite3.Cursor(self.connection).execute("EXPLAIN QUERY PLAN " + self._sql, self._params).fetchall()]
+        except Exception: plano = []
+        reg = {'rota': rota, 'ms': round(self._seg * 1000, 1), 'sql': self._sql, 'plano': plano, 'em': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        metricas.lenta(reg); log_sql.warning(json.dumps(reg, ensure_ascii=False))
+
+    def _novo(self, sql, params, logado):
+        self._concluir()
+        self._rota = request.url_rule.rule if has_request_context() and request.url_rule else '-'
+        self._sql = ' '.join(sql.split()); self._params = params; self._seg = 0.0; self._logado = logado
+        if has_request_context(): g.sql_n = g.get('sql_n', 0) + 1
+
+    def execute(self, sql, params=()):
+        self._novo(sql, params, False)
+        return self._medir(super().execute, sql, params)
+
+    def executemany(self, sql, seq):
+        self._novo(sql, None, True)  # sem plano: não há um único conjunto de parâmetros
+        return self._medir(super().executemany, sql, seq)
+
+    def fetchone(self): return self._medir(super().fetchone)
+    def fetchmany(self, *args): return self._medir(super().fetchmany, *args)
+    def fetchall(self): return self._medir(super().fetchall)
+    def close(self): self._concluir(); super().close()
+    def __del__(self): self._concluir()
+
+# --- POOL DE CONEXÕES ---
+# Cada thread recebe uma conexão reaproveitável; o close() dos handlers devolve ao pool em vez de fechar.
+PRAGMAS_PADRAO = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -20000, 'mmap_size': 268435456, 'temp_store': 'MEMORY', 'busy_timeout': 5000}
+
+class ConexaoPool(sqlite3.Connection):
+    pool = None
+    # conn.execute() do sqlite3 não passa pelo cursor(): redireciona para o CursorMedido cronometrar tudo
+    def cursor(self, factory=CursorMedido): return super().cursor(factory)
+    def execute(self, sql, params=()): return self.cursor().execute(sql, params)
+    def executemany(self, sql, seq): return self.cursor().executemany(sql, seq)
+    def close(self):
+        if self.pool is not None: self.pool.devolver(self)
+        else: super().close()
+    def fechar_de_verdade(self): self.pool = None; super().close()
+
+class PoolConexoes:
+    def __init__(self, db_path, tamanho=8, cached_statements=256, pragmas=None):
+        self.db_path = db_path; self.cached_statements = cached_statements; self.pragmas = dict(PRAGMAS_PADRAO, **(pragmas or {}))
+        self._livres = queue.LifoQueue(maxsize=tamanho); self._local = threading.local(); self._lock = threading.Lock(); self._todas = set()
+
+    def _nova(self):
+        # cached_statements > 0 = modo de statements preparados em cache (o sqlite3 reaproveita o plano por SQL idêntico)
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, factory=ConexaoPool, cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        for k, v in self.pragmas.items(): conn.execute(f"PRAGMA {k}={v}")
+        conn.pool = self
+        with self._lock: self._todas.add(conn)
+        return conn
+
+    def obter(self):
+        atual = getattr(self._local, 'conn', None)
+        if atual is not None: self._local.refs += 1; return atual
+        try: conn = self._livres.get_nowait()
+        except queue.Empty: conn = self._nova()
+        self._local.conn = conn; self._local.refs = 1
+        return conn
+
+    def em_uso(self): return getattr(self._local, 'conn', None) is not None
+
+    def redimensionar(self, tamanho):
+        # Menos vagas que threads do servidor faz cada rajada descartar e reabrir conexões (e repetir os PRAGMAs)
+        with self._livres.mutex: self._livres.maxsize = tamanho
+
+    def devolver(self, conn):
+        if getattr(self._local, 'conn', None) is not conn: self._descartar(conn); return
+        self._local.refs -= 1
+        if self._local.refs > 0: return
+        self._local.conn = None
+        if conn.in_transaction: conn.rollback()
+        try: self._livres.put_nowait(conn)
+        except queue.Full: self._descartar(conn)
+
+    def liberar_thread(self):
+        # Chamado no fim de cada request: devolve a conexão mesmo que o handler tenha saído sem close()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None: self._local.refs = 1; self.devolver(conn)
+
+    def _descartar(self, conn):
+        with self._lock: self._todas.discard(conn)
+        conn.fechar_de_verdade()
+
+    def fechar_todas(self):
+        with self._lock: todas = list(self._todas); self._todas.clear()
+        for conn in todas: conn.fechar_de_verdade()
+        self._livres = queue.LifoQueue(maxsize=self._livres.maxsize); self._local = threading.local()
+
+def _sql_digitos(col):
+    # Remove a máscara de CPF/telefone dentro do SQL (os triggers não podem depender de funções Python)
+    for ch in ".-()/ ": col = f"replace({col}, '{ch}', '')"
+    return col
+
+def _sql_fts_valores(p):
+    cpf = _sql_digitos(f"COALESCE({p}.cpf, '')"); tel = _sql_digitos(f"COALESCE({p}.telefone_principal, '')")
+    return f"{p}.id, {p}.nome, {cpf}, {tel} || ' ' || substr({tel}, 3), {p}.email"
+
+# --- MIGRAÇÕES DE SCHEMA ---
+# Lista ordenada (versão, descrição, passos). Cada passo é um SQL ou uma função(cursor). Nunca editar uma versão já publicada: criar a próxima.
+MIGRACOES = [
+    (1, 'Índices das consultas de agenda, financeiro e prontuário', [
+        "CREATE INDEX IF NOT EXISTS idx_ag_prof_inicio ON agendamentos (profissional_id, data_hora_inicio)",
+        "CREATE INDEX IF NOT EXISTS idx_ag_pac_inicio ON agendamentos (paciente_id, data_hora_inicio)",
+        "CREATE INDEX IF NOT EXISTS idx_ag_inicio ON agendamentos (data_hora_inicio)",
+        "CREATE INDEX IF NOT EXISTS idx_ag_fim ON agendamentos (data_hora_fim)",
+        "CREATE INDEX IF NOT EXISTS idx_cr_status_venc ON contas_receber (status, data_vencimento)",
+        "CREATE INDEX IF NOT EXISTS idx_cr_venc ON contas_receber (data_vencimento)",
+        "CREATE INDEX IF NOT EXISTS idx_cr_pagamento ON contas_receber (data_pagamento)",
+        "CREATE INDEX IF NOT EXISTS idx_cp_venc ON contas_pagar (data_vencimento)",
+        "CREATE INDEX IF NOT EXISTS idx_pr_pac_data ON prontuarios (paciente_id, data_atendimento)",
+        "CREATE INDEX IF NOT EXISTS idx_caixa_data ON caixa (data_hora)",
+        "CREATE INDEX IF NOT EXISTS idx_pac_nome ON pacientes (nome)",
+    ]),
+    (2, 'Índice FTS5 de busca de pacientes (nome, CPF, telefone, email)', [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS pacientes_fts USING fts5(nome, cpf, telefone, email, tokenize=\"unicode61 remove_diacritics 2\", prefix='2 3')",
+        f"INSERT INTO pacientes_fts (rowid, nome, cpf, telefone, email) SELECT {_sql_fts_valores('p')} FROM pacientes p",
+        f"CREATE TRIGGER IF NOT EXISTS trg_pac_fts_ins AFTER INSERT ON pacientes BEGIN INSERT INTO pacientes_fts (rowid, nome, cpf, telefone, email) VALUES ({_sql_fts_valores('new')}); END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_pac_fts_upd AFTER UPDATE ON pacientes BEGIN DELETE FROM pacientes_fts WHERE rowid=old.id; INSERT INTO pacientes_fts (rowid, nome, cpf, telefone, email) VALUES ({_sql_fts_valores('new')}); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_pac_fts_del AFTER DELETE ON pacientes BEGIN DELETE FROM pacientes_fts WHERE rowid=old.id; END",
+    ]),
+    (3, 'Log de alterações da agenda (versão incremental do calendário)', [
+        "CREATE TABLE IF NOT EXISTS agenda_log (versao INTEGER PRIMARY KEY AUTOINCREMENT, agendamento_id INTEGER, paciente_id INTEGER, operacao TEXT, em DATETIME DEFAULT CURRENT_TIMESTAMP)",
+        "CREATE TRIGGER IF NOT EXISTS trg_ag_log_ins AFTER INSERT ON agendamentos BEGIN INSERT INTO agenda_log (agendamento_id, paciente_id, operacao) VALUES (new.id, new.paciente_id, 'I'); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_ag_log_upd AFTER UPDATE ON agendamentos BEGIN INSERT INTO agenda_log (agendamento_id, paciente_id, operacao) VALUES (new.id, new.paciente_id, 'U'); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_ag_log_del AFTER DELETE ON agendamentos BEGIN INSERT INTO agenda_log (agendamento_id, paciente_id, operacao) VALUES (old.id, old.paciente_id, 'D'); END",
+        # O título do evento leva o nome do paciente
+        "CREATE TRIGGER IF NOT EXISTS trg_pac_log_nome AFTER UPDATE OF nome ON pacientes WHEN old.nome IS NOT new.nome BEGIN INSERT INTO agenda_log (agendamento_id, paciente_id, operacao) VALUES (NULL, new.id, 'P'); END",
+    ]),
+    (4, 'Log da agenda distingue mudança de status (S) e transferência (T)', [
+        "DROP TRIGGER IF EXISTS trg_ag_log_upd",
+        """CREATE TRIGGER trg_ag_log_upd AFTER UPDATE ON agendamentos BEGIN INSERT INTO agenda_log (agendamento_id, paciente_id, operacao) VALUES (new.id, new.paciente_id,
+            CASE WHEN old.data_hora_inicio IS NOT new.data_hora_inicio OR old.profissional_id IS NOT new.profissional_id THEN 'T'
+                 WHEN old.status IS NOT new.status THEN 'S' ELSE 'U' END); END""",
+    ]),
+    (5, 'Índice da duração dos agendamentos (limite inferior da janela do calendário)', [
+        "CREATE INDEX IF NOT EXISTS idx_ag_duracao ON agendamentos ((julianday(data_hora_fim) - julianday(data_hora_inicio)))",
+    ]),
+]
+
+# Estatísticas do planner: refeitas (ANALYZE) quando a tabela muda de tamanho por esse fator
+ESTATISTICAS_TABELAS = ('pacientes', 'agendamentos', 'contas_receber', 'contas_pagar', 'prontuarios', 'caixa')
+ESTATISTICAS_FATOR = 2; MANUTENCAO_INTERVALO = 3600  # segundos
+AGENDA_LOG_RETENCAO = 100000
+
+def intervalo_dias(ini, fim):
+    """('2024-01-01', '2024-01-31') -> ('2024-01-01', '2024-02-01'). Intervalo semiaberto [ini, fim+1): usa o índice em vez de DATE(coluna).
+    Data vazia ou inválida (campo limpo na tela) dá intervalo vazio, como o BETWEEN antigo, em vez de erro."""
+    try: datetime.strptime(ini, "%Y-%m-%d"); return ini, (datetime.strptime(fim, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    except (TypeError, ValueError): return ini, ini
+
+def intervalo_hoje():
+    h = datetime.now().date(); return h.strftime("%Y-%m-%d"), (h + timedelta(days=1)).strftime("%Y-%m-%d")
+
+def intervalo_mes():
+    h = datetime.now().date(); ini = h.replace(day=1); prox = (ini.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return ini.strftime("%Y-%m-%d"), prox.strftime("%Y-%m-%d")
+
+def codificar_cursor(*valores):
+    """Cursor opaco de paginação keyset (devolvido no header X-Proximo-Cursor)."""
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+def decodificar_cursor(cur):
+    if not cur: return None
+    try: return json.loads(base64.urlsafe_b64decode(cur.encode()))
+    except Exception: return None
+
+def colunas_tabela(conn, tabela, alias):
+    return {r['name']: f"{alias}.{r['name']}" for r in conn.execute(f"PRAGMA table_info({tabela})")}
+
+def listar_keyset(conn, origem, colunas, ordem, where=None, params=(), desc=False, limite_padrao=None):
+    """Lista paginada por keyset. colunas = {nome: expressão SQL} (whitelist do ?campos=a,b); ordem = nomes das colunas de ordenação,
+    a última única (id). ?limit= (sem ele, e sem limite_padrao, vem tudo) e ?cursor= (do header X-Proximo-Cursor)."""
+    pedidos = [c for c in request.args.get('campos', '').split(',') if c in colunas] or list(colunas)
+    sel = ', '.join(f"{colunas[c]} AS {c}" for c in dict.fromkeys(pedidos + list(ordem)))
+    w = [where] if where else []; p = list(params); cur = decodificar_cursor(request.args.get('cursor'))
+    if cur and len(cur) == len(ordem): w.append(f"({', '.join(colunas[k] for k in ordem)}) {'<' if desc else '>'} ({', '.join('?' * len(ordem))})"); p += cur
+    q = f"SELECT {sel} FROM {origem}" + (" WHERE " + " AND ".join(w) if w else "") + " ORDER BY " + ', '.join(colunas[k] + (' DESC' if desc else '') for k in ordem)
+    limite = request.args.get('limit', limite_padrao, type=int)
+    if limite: q += " LIMIT ?"; p.append(limite)
+    linhas = conn.execute(q, p).fetchall(); resp = jsonify([{k: r[k] for k in pedidos} for r in linhas])
+    if limite and len(linhas) == limite: resp.headers['X-Proximo-Cursor'] = codificar_cursor(*[linhas[-1][k] for k in ordem])
+    return resp
+
+def termo_fts(texto):
+    """'maria-clara 123.456' -> '"maria clara"* "123456"*': cada palavra vira prefixo, sem deixar passar sintaxe FTS do usuário.
+    A pontuação separa tokens como no tokenizer (nomes compostos, e-mail); só CPF/telefone mascarados viram um número só, como no índice."""
+    termos = []
+    for w in texto.split():
+        partes = re.findall(r'[^\W_]+', w)
+        if not partes: continue
+        if all(p.isdigit() for p in partes): partes = [''.join(partes)]
+        termos.append('"' + ' '.join(partes) + '"*')
+    return ' '.join(termos)
+
 class Database:
-    def __init__(self, db_name="clinica.db"):
+    """O arquivo só é criado/migrado na primeira conexão: importar o módulo (ex.: modo --cliente) não toca no banco."""
+    def __init__(self, db_name="clinica.db", pool_size=8, cached_statements=256):
         self.db_path = os.path.join(DATA_DIR, db_name)
-        self.init_db()
+        self.pool = PoolConexoes(self.db_path, pool_size, cached_statements)
+        self._iniciado = False; self._lock_inicio = threading.Lock(); self._agenda = None
+
+    def iniciar(self):
+        with self._lock_inicio:
+            if not self._iniciado: self.init_db(); self._iniciado = True
 
     def conectar(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        if not self._iniciado: self.iniciar()
+        return self.pool.obter()
+
+    @property
+    def agenda(self):
+        """Índice de disponibilidade (IndiceAgenda) desta base, criado no primeiro uso."""
+        if self._agenda is None:
+            with self._lock_inicio:
+                if self._agenda is None: self._agenda = IndiceAgenda(self)
+        return self._agenda
+
+    @contextmanager
+    def conexao(self):
+        """Uso: with db.conexao() as conn: ... (commit no sucesso, rollback no erro, devolve ao pool).
+        Aninhado dentro de outra conexão da mesma thread, participa da transação de fora e não faz commit."""
+        if self.pool.em_uso():
+            conn = self.conectar()
+            try: yield conn
+            finally: conn.close()
+            return
+        conn = self.conectar()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback(); raise
+        finally:
+            conn.close()
 
     def init_db(self):
-        conn = self.conectar(); c = conn.cursor()
+        conn = self.pool.obter(); c = conn.cursor()
         c.execute("CREATE TABLE IF NOT EXISTS usuarios (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password_hash TEXT, role TEXT)")
         c.execute("CREATE TABLE IF NOT EXISTS configuracoes (id INTEGER PRIMARY KEY, nome_clinica TEXT, endereco TEXT, telefone TEXT, cnpj TEXT)")
         c.execute("CREATE TABLE IF NOT EXISTS pacientes (id INTEGER PRIMARY KEY, nome TEXT, cpf TEXT, rg TEXT, data_nascimento DATE, sexo TEXT, telefone_principal TEXT, telefone_secundario TEXT, email TEXT, endereco TEXT, convenio_id INTEGER, observacoes_medicas TEXT, medicamentos_em_uso TEXT, responsavel TEXT, foto TEXT, ativo INTEGER DEFAULT 1, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
@@ -83,20 +412,346 @@ class Database:
         # --- AUTO-CORREÇÃO: CORRIGIR STATUS NULL (O problema da sua imagem) ---
         c.execute("UPDATE agendamentos SET status='Agendado' WHERE status IS NULL OR status = 'null'")
         
-        conn.commit(); conn.close()
+        conn.commit()
+        self.migrar(conn)
+        self.manutencao(conn)
+        conn.close()
+
+    def atualizar_estatisticas(self, conn):
+        """ANALYZE das tabelas cujo nº de linhas mudou mais que ESTATISTICAS_FATOR desde o último (ou que nunca tiveram).
+        Estatísticas da base ainda pequena fazem o planner escolher varreduras aninhadas quando ela cresce.
+        Sem analysis_limit: com ele a contagem gravada é estimada (erra 2x) e a comparação de tamanho não funciona."""
+        tem_stat = conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()
+        antigas = {t: int(st.split()[0]) for t, st in conn.execute("SELECT tbl, MAX(stat) FROM sqlite_stat1 WHERE idx IS NOT NULL GROUP BY tbl")} if tem_stat else {}
+        refeitas = []
+        for t in ESTATISTICAS_TABELAS:
+            n = conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]; antes = antigas.get(t)
+            if (antes is None and n > 0) or (antes is not None and not antes / ESTATISTICAS_FATOR <= n <= antes * ESTATISTICAS_FATOR):
+                conn.execute(f"ANALYZE {t}"); refeitas.append(t)
+        conn.commit(); return refeitas
+
+    def manutencao(self, conn):
+        """Estatísticas do planner e poda do agenda_log (mantém as últimas AGENDA_LOG_RETENCAO versões)."""
+        self.atualizar_estatisticas(conn)
+        conn.execute("DELETE FROM agenda_log WHERE versao <= (SELECT MAX(versao) FROM agenda_log) - ?", (AGENDA_LOG_RETENCAO,)); conn.commit()
+
+    def agendar_manutencao(self, intervalo=MANUTENCAO_INTERVALO):
+        """Servidor de longa duração: repete a manutenção do init_db a cada `intervalo` segundos."""
+        def loop():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    with self.conexao() as conn: self.manutencao(conn)
+                except sqlite3.Error: log_app.exception("Falha na manutenção do banco")
+        threading.Thread(target=loop, daemon=True).start()
+
+    def versao_schema(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (versao INTEGER PRIMARY KEY, descricao TEXT, aplicada_em DATETIME DEFAULT CURRENT_TIMESTAMP)")
+        return conn.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version").fetchone()[0]
+
+    def migrar(self, conn):
+        atual = self.versao_schema(conn); conn.commit()
+        for versao, descricao, passos in MIGRACOES:
+            if versao <= atual: continue
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for p in passos:
+                    if callable(p): p(conn.cursor())
+                    else: conn.execute(p)
+                conn.execute("INSERT INTO schema_version (versao, descricao) VALUES (?,?)", (versao, descricao))
+                conn.commit()
+            except Exception:
+                conn.rollback(); raise
+
+db = Database(os.environ.get('CLINICA_DB', 'clinica.db'))  # CLINICA_DB: outro arquivo (ex.: base sintética do benchmark)
+
+@app.teardown_request
+def liberar_conexao(exc): db.pool.liberar_thread()
+
+@app.before_request
+def iniciar_cronometro(): g.t0 = time.perf_counter()
+
+@app.after_request
+def registrar_metricas(resp):
+    seg = time.perf_counter() - g.get('t0', time.perf_counter()); rota = request.url_rule.rule if request.url_rule else 'nao_encontrada'
+    metricas.request(rota, request.method, resp.status_code, seg)
+    if request.headers.get('X-Profile'):
+        # Perfil do request: tempo total x SQL (aparece no DevTools via Server-Timing)
+        sql_ms = g.get('sql_seg', 0.0) * 1000
+        resp.headers['Server-Timing'] = f"total;dur={seg * 1000:.1f}, sql;dur={sql_ms:.1f};desc=\"{g.get('sql_n', 0)} consultas\""
+        resp.headers['X-SQL-Consultas'] = str(g.get('sql_n', 0)); resp.headers['X-SQL-ms'] = f"{sql_ms:.1f}"; resp.headers['X-Tempo-ms'] = f"{seg * 1000:.1f}"
+    return resp
+
+# --- CACHE DO DASHBOARD ---
+class CacheDashboard:
+    """Guarda o último resultado do dash(). Expira nas escritas de agenda/financeiro, na virada do dia e após ttl segundos (a lista de próximos depende da hora)."""
+    def __init__(self, ttl=60):
+        self.ttl = ttl; self._lock = threading.Lock(); self._geracao = 0; self._valor = None
+
+    def obter(self, calcular):
+        chave = datetime.now().strftime("%Y-%m-%d")
+        with self._lock: valor, geracao = self._valor, self._geracao
+        if valor and valor[0] == chave and time.monotonic() - valor[1] < self.ttl: return valor[2]
+        dados = calcular()
+        with self._lock:
+            # Se houve escrita durante o cálculo, o resultado já nasce velho: não guarda
+            if geracao == self._geracao: self._valor = (chave, time.monotonic(), dados)
+        return dados
+
+    def invalidar(self):
+        with self._lock: self._geracao += 1; self._valor = None
+
+cache_dash = CacheDashboard()
+
+# --- CANAL DE EVENTOS (SSE) ---
+class CanalEventos:
+    """Acorda os streams SSE quando uma escrita na agenda é commitada. O conteúdo vem do agenda_log, então o id do evento serve de token de retomada.
+    Cada stream aberto prende uma thread do servidor: as vagas limitam quantos ficam abertos ao mesmo tempo."""
+    def __init__(self, vagas=8):
+        self._cond = threading.Condition(); self._seq = 0; self.limitar(vagas)
+
+    def limitar(self, vagas): self.vagas = threading.BoundedSemaphore(vagas)
+
+    def publicar(self):
+        with self._cond: self._seq += 1; self._cond.notify_all()
+
+    def aguardar(self, seq, timeout):
+        with self._cond: self._cond.wait_for(lambda: self._seq != seq, timeout); return self._seq
+
+canal_agenda = CanalEventos()
+SSE_HEARTBEAT = 15; SSE_DURACAO_MAX = 300  # segundos; ao fechar, o EventSource reconecta sozinho com Last-Event-ID
+OPERACOES_LOG = {'I': 'criado', 'U': 'alterado', 'S': 'status', 'T': 'transferido', 'D': 'removido', 'P': 'paciente'}
+
+def notifica_agenda(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        r = f(*args, **kwargs); canal_agenda.publicar(); return r
+    return wrapper
+
+# --- BACKUP ONLINE ---
+BACKUP_DIR = os.path.join(DATA_DIR, 'backups')
+BACKUP_PAGINAS = 1024; BACKUP_RETENCAO = 14; BACKUP_INTERVALO_HORAS = 24
+
+class BackupReiniciado(Exception): pass
+
+class MotorBackup:
+    """Snapshot via sqlite3.Connection.backup em passos de páginas, comprimido em .db.gz, numa thread própria (um job por vez)."""
+    def __init__(self, db_path, pasta=BACKUP_DIR, retencao=BACKUP_RETENCAO):
+        self.db_path = db_path; self.pasta = pasta; self.retencao = retencao
+        self._lock = threading.Lock(); self.job = None
+
+    def iniciar(self):
+        with self._lock:
+            if self.job and self.job['estado'] == 'executando': return self.job
+            self.job = {'id': uuid.uuid4().hex[:12], 'estado': 'executando', 'progresso': 0, 'arquivo': None, 'erro': None, 'inicio': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'fim': None}
+            job = self.job
+        threading.Thread(target=self._executar, args=(job,), daemon=True).start()
+        return job
+
+    def _executar(self, job):
+        os.makedirs(self.pasta, exist_ok=True)
+        nome = f"clinica_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"; tmp = os.path.join(self.pasta, nome + '.tmp')
+        try:
+            self._copiar(tmp, job); job['progresso'] = 95
+            # Compressão em streaming: nunca carrega o banco inteiro em memória
+            with open(tmp, 'rb') as src, gzip.open(os.path.join(self.pasta, nome + '.gz.tmp'), 'wb', compresslevel=6) as dst: shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(os.path.join(self.pasta, nome + '.gz.tmp'), os.path.join(self.pasta, nome + '.gz'))
+            job.update(estado='concluido', progresso=100, arquivo=nome + '.gz'); self.aplicar_retencao()
+        except Exception as e:
+            job.update(estado='erro', erro=str(e))
+        finally:
+            for f in (tmp, os.path.join(self.pasta, nome + '.gz.tmp')):
+                if os.path.exists(f): os.remove(f)
+            job['fim'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _copiar(self, destino, job):
+        # Em passos de BACKUP_PAGINAS os escritores seguem livres entre um passo e outro. Se a cópia reinicia demais (banco mudando sem parar),
+        # cai para um passo único: em WAL ele lê um snapshot consistente sem bloquear quem escreve.
+        reinicios = {'n': 0, 'restante': None}
+        def progresso(status, restante, total):
+            if reinicios['restante'] is not None and restante > reinicios['restante']: reinicios['n'] += 1
+            if reinicios['n'] > 5: raise BackupReiniciado()
+            reinicios['restante'] = restante; job['progresso'] = int(90 * (total - restante) / total) if total else 90
+        src = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            for paginas in (BACKUP_PAGINAS, -1):
+                dst = sqlite3.connect(destino)
+                try: src.backup(dst, pages=paginas, progress=progresso if paginas > 0 else None, sleep=0.005); return
+                except BackupReiniciado: pass
+                finally: dst.close()
+        finally: src.close()
+
+    def listar(self):
+        if not os.path.isdir(self.pasta): return []
+        arqs = sorted((f for f in os.listdir(self.pasta) if f.startswith('clinica_') and f.endswith('.db.gz')), reverse=True)
+        return [{'arquivo': f, 'tamanho': os.path.getsize(os.path.join(self.pasta, f))} for f in arqs]
+
+    def aplicar_retencao(self):
+        for b in self.listar()[self.retencao:]: os.remove(os.path.join(self.pasta, b['arquivo']))
 
-db = Database()
+    def agendar(self, intervalo_horas=BACKUP_INTERVALO_HORAS):
+        """Snapshot automático: checa a cada 10 min se o último backup é mais velho que o intervalo."""
+        def loop():
+            while True:
+                ult = self.listar()
+                idade = time.time() - os.path.getmtime(os.path.join(self.pasta, ult[0]['arquivo'])) if ult else None
+                if idade is None or idade >= intervalo_horas * 3600: self.iniciar()
+                time.sleep(600)
+        threading.Thread(target=loop, daemon=True).start()
+
+motor_backup = MotorBackup(db.db_path)
+
+# --- ÍNDICE DE DISPONIBILIDADE ---
+EXPEDIENTE_PADRAO = ('08:00', '18:00'); DIAS_UTEIS = (0, 1, 2, 3, 4)
+DIAS_SEMANA = {'seg': 0, 'ter': 1, 'qua': 2, 'qui': 3, 'sex': 4, 'sab': 5, 'sáb': 5, 'dom': 6}
+INDICE_HORIZONTE_DIAS = 1  # agendamentos que terminaram antes disso ficam fora da memória (a checagem cai no SQL)
+DISPONIBILIDADE_MAX_DIAS = 60; DISPONIBILIDADE_MAX_N = 200; DURACAO_MAX = 720  # limites da busca de horários livres
+
+def parse_disponibilidade(texto):
+    """JSON do save_prof -> {dia_semana: [(time_ini, time_fim)]}. Aceita ["seg","ter"], [0,2] ou [{"dia":"seg","inicio":"08:00","fim":"12:00"}]; vazio = seg-sex no expediente padrão."""
+    try: itens = json.loads(texto) if texto else []
+    except ValueError: itens = []
+    if isinstance(itens, str): itens = [x.strip() for x in itens.split(',')]
+    hora = lambda h: datetime.strptime(h, "%H:%M").time()
+    grade = {}
+    for it in itens if isinstance(itens, list) else []:
+        if not isinstance(it, dict): it = {'dia': it}
+        dia = it.get('dia'); dia = DIAS_SEMANA.get(str(dia).strip().lower()[:3]) if not isinstance(dia, int) else dia
+        try: janela = (hora(it.get('inicio', EXPEDIENTE_PADRAO[0])), hora(it.get('fim', EXPEDIENTE_PADRAO[1])))
+        except (TypeError, ValueError): continue
+        if dia in range(7) and janela[0] < janela[1]: grade.setdefault(dia, []).append(janela)
+    if not grade: grade = {dia: [(hora(EXPEDIENTE_PADRAO[0]), hora(EXPEDIENTE_PADRAO[1]))] for dia in DIAS_UTEIS}
+    return {dia: sorted(j) for dia, j in grade.items()}
+
+class IndiceAgenda:
+    """Intervalos ocupados por profissional, ordenados por início (bisect). Sincroniza pelo agenda_log antes de cada consulta, então acompanha qualquer escrita na agenda."""
+    def __init__(self, database):
+        self.db = database; self._lock = threading.RLock(); self._versao = None
+        self._por_prof = {}; self._por_id = {}; self._dur_max = {}; self.horizonte = None
+
+    def _linha(self, r):
+        ini = datetime.fromisoformat(r['data_hora_inicio']); fim = datetime.fromisoformat(r['data_hora_fim']) if r['data_hora_fim'] else ini + timedelta(minutes=r['duracao_minutos'] or 30)
+        return r['id'], r['profissional_id'], ini, fim
+
+    def _adicionar(self, ag_id, prof, ini, fim):
+        bisect.insort(self._por_prof.setdefault(prof, []), (ini, fim, ag_id)); self._por_id[ag_id] = (prof, ini, fim)
+        self._dur_max[prof] = max(self._dur_max.get(prof, timedelta(0)), fim - ini)
+
+    def _remover(self, ag_id):
+        if ag_id not in self._por_id: return
+        prof, ini, fim = self._por_id.pop(ag_id); lst = self._por_prof[prof]; i = bisect.bisect_left(lst, (ini, fim, ag_id))
+        if i < len(lst) and lst[i][2] == ag_id: del lst[i]
+
+    def _sincronizar(self):
+        sql = "SELECT id, profissional_id, data_hora_inicio, data_hora_fim, duracao_minutos FROM agendamentos WHERE (status!='Cancelado' OR status IS NULL) AND data_hora_inicio IS NOT NULL AND COALESCE(data_hora_fim, data_hora_inicio) >= ?"
+        with self.db.conexao() as conn:
+            versao = conn.execute("SELECT COALESCE(MAX(versao), 0) FROM agenda_log").fetchone()[0]
+            if versao == self._versao: return
+            mud = None if self._versao is None else [r[0] for r in conn.execute("SELECT DISTINCT agendamento_id FROM agenda_log WHERE versao > ? AND agendamento_id IS NOT NULL", (self._versao,))]
+            if mud is None or len(mud) > 5000:
+                self._por_prof, self._por_id, self._dur_max = {}, {}, {}
+                self.horizonte = (datetime.now() - timedelta(days=INDICE_HORIZONTE_DIAS)).replace(hour=0, minute=0, second=0, microsecond=0)
+                linhas = conn.execute(sql, (self.horizonte.strftime("%Y-%m-%d"),)).fetchall()
+            else:
+                for ag_id in mud: self._remover(ag_id)
+                linhas = conn.execute(sql + " AND id IN (SELECT value FROM json_each(?))", (self.horizonte.strftime("%Y-%m-%d"), json.dumps(mud))).fetchall()
+            for r in linhas: self._adicionar(*self._linha(r))
+            self._versao = versao
+
+    def _ocupados(self, prof, ini, fim):
+        # Só quem começa entre ini - maior duração e fim pode encostar em [ini, fim): O(log n) + os vizinhos
+        lst = self._por_prof.get(prof, []); dmax = self._dur_max.get(prof, timedelta(0))
+        a = bisect.bisect_left(lst, (ini - dmax,)); b = bisect.bisect_left(lst, (fim,))
+        return [x for x in lst[a:b] if x[1] > ini]
+
+    def conflito(self, prof, ini, fim, ignorar_id=None):
+        """Id do agendamento que ocupa [ini, fim) para o profissional, ou None."""
+        prof = int(prof); ignorar_id = int(ignorar_id) if ignorar_id else None
+        with self._lock:
+            self._sincronizar()
+            if ini >= self.horizonte: return next((x[2] for x in self._ocupados(prof, ini, fim) if x[2] != ignorar_id), None)
+        q = "SELECT id FROM agendamentos WHERE profissional_id=? AND (status!='Cancelado' OR status IS NULL) AND data_hora_inicio < ? AND data_hora_fim > ?"; p = [prof, fim.strftime("%Y-%m-%d %H:%M:%S"), ini.strftime("%Y-%m-%d %H:%M:%S")]
+        if ignorar_id: q += " AND id!=?"; p.append(ignorar_id)
+        with self.db.conexao() as conn: r = conn.execute(q, p).fetchone()
+        return r['id'] if r else None
+
+    def proximos_livres(self, prof, grade, desde, duracao, n, dias=14, passo=None):
+        """Até n horários livres de `duracao` minutos a partir de `desde`, dentro da grade semanal, alinhados a `passo` minutos."""
+        passo = passo or duracao; duracao = timedelta(minutes=duracao); prof = int(prof); livres = []
+        with self._lock:
+            self._sincronizar(); desde = max(desde, self.horizonte)
+            for k in range(dias):
+                dia = (desde + timedelta(days=k)).date()
+                for h_ini, h_fim in grade.get(dia.weekday(), []):
+                    w_ini, w_fim = datetime.combine(dia, h_ini), datetime.combine(dia, h_fim); t = w_ini
+                    if t < desde: t = w_ini + timedelta(minutes=-(-int((desde - w_ini).total_seconds() // 60) // passo) * passo)
+                    while t + duracao <= w_fim:
+                        ocup = self._ocupados(prof, t, t + duracao)
+                        if not ocup: livres.append(t); t += timedelta(minutes=passo)
+                        else:
+                            # pula direto para o fim do bloqueio, mantendo o alinhamento da grade
+                            fim_oc = max(x[1] for x in ocup); t = w_ini + timedelta(minutes=-(-int((fim_oc - w_ini).total_seconds() // 60) // passo) * passo)
+                        if len(livres) >= n: return livres
+        return livres
+
+def invalida_dashboard(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        r = f(*args, **kwargs); cache_dash.invalidar(); return r
+    return wrapper
+
+# --- CACHE DE USUÁRIOS ---
+class CacheUsuarios:
+    """LRU com TTL do load_user: evita a consulta em usuarios a cada request autenticado."""
+    def __init__(self, maximo=256, ttl=300):
+        self.maximo = maximo; self.ttl = ttl; self._lock = threading.Lock(); self._itens = OrderedDict()
+
+    def obter(self, user_id):
+        with self._lock:
+            item = self._itens.get(user_id)
+            if item is None: return None
+            if time.monotonic() - item[0] > self.ttl: del self._itens[user_id]; return None
+            self._itens.move_to_end(user_id); return item[1]
+
+    def guardar(self, user_id, user):
+        with self._lock:
+            self._itens[user_id] = (time.monotonic(), user); self._itens.move_to_end(user_id)
+            while len(self._itens) > self.maximo: self._itens.popitem(last=False)
+
+    def invalidar(self, user_id=None):
+        """Chamar depois de mudar senha ou papel (role) de um usuário; sem id limpa tudo."""
+        with self._lock:
+            if user_id is None: self._itens.clear()
+            else: self._itens.pop(str(user_id), None)
+
+cache_usuarios = CacheUsuarios()
 
 @login_manager.user_loader
 def load_user(user_id):
-    conn = db.conectar(); u = conn.execute("SELECT * FROM usuarios WHERE id=?", (user_id,)).fetchone(); conn.close()
-    return User(u['id'], u['username'], u['role']) if u else None
+    s = session.get('usuario') if app.config['SESSAO_ASSINADA'] else None
+    if s and str(s.get('id')) == str(user_id): return User(s['id'], s['username'], s['role'])
+    user = cache_usuarios.obter(str(user_id))
+    if user: return user
+    conn = db.conectar(); u = conn.execute("SELECT id, username, role FROM usuarios WHERE id=?", (user_id,)).fetchone(); conn.close()
+    if not u: return None
+    user = User(u['id'], u['username'], u['role']); cache_usuarios.guardar(str(user_id), user); return user
 
 @login_manager.unauthorized_handler
 def login_error(): return jsonify({"erro": "Acesso negado"}), 401
 
 @app.route('/')
-def index(): return send_from_directory(BASE_DIR, 'sistema.html')
+def index():
+    # sistema.html comprimido uma vez por versão do arquivo; ETag/Last-Modified do próprio arquivo
+    caminho = os.path.join(BASE_DIR, 'sistema.html'); st = os.stat(caminho); enc = codificacao_aceita(); chave = (st.st_mtime_ns, st.st_size, enc)
+    corpo = _cache_index.get(chave)
+    if corpo is None:
+        with open(caminho, 'rb') as f: corpo = f.read()
+        if enc: corpo = comprimir(corpo, enc)
+        _cache_index.clear(); _cache_index[chave] = corpo  # só a versão atual (o app pede sempre a mesma codificação)
+    resp = Response(corpo, mimetype='text/html'); resp.set_etag(f"{st.st_mtime_ns:x}-{st.st_size:x}", weak=True); resp.last_modified = datetime.fromtimestamp(st.st_mtime)
+    resp.headers['Cache-Control'] = 'no-cache'; resp.vary.add('Accept-Encoding')
+    if enc: resp.headers['Content-Encoding'] = enc
+    return resp.make_conditional(request)
 
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -104,14 +759,15 @@ def login():
         d = request.json; conn = db.conectar()
         u = conn.execute("SELECT * FROM usuarios WHERE username=?", (d['username'],)).fetchone(); conn.close()
         if u and check_password_hash(u['password_hash'], d['password']):
-            login_user(User(u['id'], u['username'], u['role']))
+            login_user(User(u['id'], u['username'], u['role'])); cache_usuarios.invalidar(u['id'])
+            if app.config['SESSAO_ASSINADA']: session['usuario'] = {'id': u['id'], 'username': u['username'], 'role': u['role']}
             return jsonify({"msg": "Logado", "user": u['username']})
         return jsonify({"erro": "Dados inválidos"}), 401
     except Exception as e: return jsonify({"erro": str(e)}), 500
 
 @app.route('/api/logout', methods=['POST'])
 @login_required
-def logout(): logout_user(); return jsonify({"msg": "Saiu"})
+def logout(): session.pop('usuario', None); logout_user(); return jsonify({"msg": "Saiu"})
 
 @app.route('/api/check_auth')
 def check_auth():
@@ -122,7 +778,7 @@ def check_auth():
 @login_required
 def get_config():
     conn = db.conectar(); c = conn.execute("SELECT * FROM configuracoes WHERE id=1").fetchone(); conn.close()
-    data = dict(c) if c else {}; data['ip_rede'] = obter_ip_rede(); return jsonify(data)
+    data = dict(c) if c else {}; data['ip_rede'] = app.config.get('IP_REDE') or app.config.setdefault('IP_REDE', obter_ip_rede()); return jsonify(data)
 
 @app.route('/api/config/salvar', methods=['POST'])
 @login_required
@@ -134,31 +790,48 @@ def save_config():
 def mudar_senha():
     d=request.json; conn=db.conectar(); u = conn.execute("SELECT password_hash FROM usuarios WHERE id = ?", (current_user.id,)).fetchone()
     if not u or not check_password_hash(u['password_hash'], d['antiga']): conn.close(); return jsonify({"erro": "Senha antiga incorreta"}), 401
-    conn.execute("UPDATE usuarios SET password_hash = ? WHERE id = ?", (generate_password_hash(d['nova']), current_user.id)); conn.commit(); conn.close(); return jsonify({"msg": "Sucesso"})
+    conn.execute("UPDATE usuarios SET password_hash = ? WHERE id = ?", (generate_password_hash(d['nova']), current_user.id)); conn.commit(); conn.close(); cache_usuarios.invalidar(current_user.id); return jsonify({"msg": "Sucesso"})
 
 @app.route('/api/backup')
 @login_required
 def backup():
-    bkp = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"; shutil.copy2(db.db_path, os.path.join(DATA_DIR, bkp)); return send_file(os.path.join(DATA_DIR, bkp), as_attachment=True)
+    # Compatibilidade: espera o job terminar e já entrega o .db.gz. A tela usa iniciar/status/download.
+    job = motor_backup.iniciar()
+    while job['estado'] == 'executando': time.sleep(0.2)
+    if job['estado'] == 'erro': return jsonify({"erro": job['erro']}), 500
+    return send_from_directory(motor_backup.pasta, job['arquivo'], as_attachment=True)
+
+@app.route('/api/backup/iniciar', methods=['POST'])
+@login_required
+def backup_iniciar(): return jsonify(motor_backup.iniciar()), 202
+
+@app.route('/api/backup/status')
+@login_required
+def backup_status(): return jsonify({'job': motor_backup.job, 'backups': motor_backup.listar()})
+
+@app.route('/api/backup/download/<nome>')
+@login_required
+def backup_download(nome):
+    if nome not in {b['arquivo'] for b in motor_backup.listar()}: return jsonify({"erro": "Backup não encontrado"}), 404
+    return send_from_directory(motor_backup.pasta, nome, as_attachment=True)
 
 @app.route('/api/dashboard_stats')
 @login_required
-def dash():
+def dash(): return jsonify(cache_dash.obter(calcular_dash))
+
+def calcular_dash():
     conn = db.conectar(); c = conn.cursor()
     
-    h_ini = datetime.now().strftime("%Y-%m-%d 00:00:00")
-    h_fim = datetime.now().strftime("%Y-%m-%d 23:59:59")
-    m_ini = datetime.now().strftime("%Y-%m-01 00:00:00")
-    prox_mes = (datetime.now().replace(day=28) + timedelta(days=4)).replace(day=1)
-    mes_fim = (prox_mes - timedelta(seconds=1)).strftime("%Y-%m-%d 23:59:59")
+    h_ini, h_fim = intervalo_hoje()
+    m_ini, mes_fim = intervalo_mes()
     agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     s = {'hoje': 0, 'mes': 0, 'faturamento': 0, 'pendencias': 0, 'proximos': [], 'grafico': []}
     try:
         # Conta tudo que não é cancelado. Se status for NULL, a correção no init_db resolveu, mas aqui garantimos.
-        s['hoje'] = c.execute("SELECT COUNT(*) FROM agendamentos WHERE data_hora_inicio BETWEEN ? AND ? AND (status!='Cancelado' OR status IS NULL)", (h_ini, h_fim)).fetchone()[0]
-        s['mes'] = c.execute("SELECT COUNT(*) FROM agendamentos WHERE data_hora_inicio BETWEEN ? AND ? AND (status!='Cancelado' OR status IS NULL)", (m_ini, mes_fim)).fetchone()[0]
-        s['faturamento'] = c.execute("SELECT COALESCE(SUM(valor_pago),0) FROM contas_receber WHERE data_pagamento BETWEEN ? AND ?", (m_ini, mes_fim)).fetchone()[0]
+        s['hoje'] = c.execute("SELECT COUNT(*) FROM agendamentos WHERE data_hora_inicio >= ? AND data_hora_inicio < ? AND (status!='Cancelado' OR status IS NULL)", (h_ini, h_fim)).fetchone()[0]
+        s['mes'] = c.execute("SELECT COUNT(*) FROM agendamentos WHERE data_hora_inicio >= ? AND data_hora_inicio < ? AND (status!='Cancelado' OR status IS NULL)", (m_ini, mes_fim)).fetchone()[0]
+        s['faturamento'] = c.execute("SELECT COALESCE(SUM(valor_pago),0) FROM contas_receber WHERE data_pagamento >= ? AND data_pagamento < ?", (m_ini, mes_fim)).fetchone()[0]
         s['pendencias'] = c.execute("SELECT COUNT(*) FROM contas_receber WHERE status='Pendente' AND data_vencimento < ?", (h_ini,)).fetchone()[0]
         
         # CORREÇÃO PRÓXIMOS: Mostra se a hora de FIM é maior que agora (ou seja, ainda está rolando ou vai rolar)
@@ -175,64 +848,198 @@ def dash():
         """
         s['proximos'] = [dict(r) for r in c.execute(sql_prox, (agora,)).fetchall()]
         
-        s['grafico'] = [{'nome': r['nome'] or 'Geral', 'total': r['total']} for r in c.execute("SELECT e.nome, COUNT(a.id) as total FROM agendamentos a JOIN profissionais p ON a.profissional_id = p.id LEFT JOIN especialidades e ON p.especialidade_id = e.id WHERE a.data_hora_inicio BETWEEN ? AND ? AND a.status != 'Cancelado' GROUP BY e.nome ORDER BY total DESC", (m_ini, mes_fim)).fetchall()]
+        s['grafico'] = [{'nome': r['nome'] or 'Geral', 'total': r['total']} for r in c.execute("SELECT e.nome, COUNT(a.id) as total FROM agendamentos a JOIN profissionais p ON a.profissional_id = p.id LEFT JOIN especialidades e ON p.especialidade_id = e.id WHERE a.data_hora_inicio >= ? AND a.data_hora_inicio < ? AND a.status != 'Cancelado' GROUP BY e.nome ORDER BY total DESC", (m_ini, mes_fim)).fetchall()]
     except Exception as e:
-        print("Erro Dash:", e)
+        log_app.exception("Erro Dash: %s", e); metricas.erro('dashboard'); cache_dash.invalidar()
     
-    conn.close(); return jsonify(s)
+    conn.close(); return s
 
 @app.route('/api/agenda/calendario', methods=['GET'])
 @login_required
 def cal_ag():
-    conn=db.conectar(); evs=[]; cores={'Agendado':'#F59E0B','Confirmado':'#3B82F6','Realizado':'#10B981','NoShow':'#EF4444','Em Espera':'#8B5CF6','Em Atendimento':'#EC4899'}
+    # ?start=&end= (janela do FullCalendar), ?prof_id=, ?desde=<versao> (só o que mudou). ETag = versão da agenda + filtros.
+    ini, fim, prof, desde = data_iso(request.args.get('start')), data_iso(request.args.get('end')), request.args.get('prof_id'), request.args.get('desde', type=int)
+    conn=db.conectar(); versao = conn.execute("SELECT COALESCE(MAX(versao), 0) FROM agenda_log").fetchone()[0]
+    tag = f"cal-{versao}-{ini}-{fim}-{prof}-{desde}"
+    if request.if_none_match.contains_weak(tag): conn.close(); return resposta_304(tag)
     # Adicionado "OR status IS NULL" para garantir que o evento apareça mesmo se bugado
-    for r in conn.execute("SELECT a.id, a.data_hora_inicio, a.data_hora_fim, COALESCE(a.status, 'Agendado') as status, p.nome as paciente FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id WHERE a.status!='Cancelado' OR a.status IS NULL").fetchall():
-        st = r['status']
-        evs.append({'id':r['id'],'title':f"{r['paciente']} ({st})",'start':r['data_hora_inicio'],'end':r['data_hora_fim'],'backgroundColor':cores.get(st,'#6B7280'),'borderColor':cores.get(st,'#6B7280')})
-    conn.close(); return jsonify(evs)
+    w = ["(a.status!='Cancelado' OR a.status IS NULL)"]; p = []
+    if ini:
+        w.append("a.data_hora_fim > ?"); p.append(ini)
+        piso = inicio_minimo(conn, ini)
+        if piso: w.append("a.data_hora_inicio > ?"); p.append(piso)
+    if fim: w.append("a.data_hora_inicio < ?"); p.append(fim)
+    if prof: w.append("a.profissional_id=?"); p.append(prof)
+    minimo = conn.execute("SELECT COALESCE(MIN(versao), 1) FROM agenda_log").fetchone()[0]
+    if desde is not None and desde >= minimo - 1:
+        mud = conn.execute("SELECT agendamento_id, paciente_id, operacao FROM agenda_log WHERE versao > ?", (desde,)).fetchall()
+        ids = sorted({m['agendamento_id'] for m in mud if m['agendamento_id'] is not None}); pacs = sorted({m['paciente_id'] for m in mud if m['operacao'] == 'P'})
+        w.append("(a.id IN (SELECT value FROM json_each(?)) OR a.paciente_id IN (SELECT value FROM json_each(?)))"); p += [json.dumps(ids), json.dumps(pacs)]
+        evs = eventos_calendario(conn, w, p); conn.close(); vistos = {e['id'] for e in evs}
+        corpo = {'versao': versao, 'completo': False, 'eventos': evs, 'removidos': [i for i in ids if i not in vistos]}
+    elif desde is not None:
+        # Log já podado além da versão pedida: manda tudo e o cliente substitui o que tem
+        evs = eventos_calendario(conn, w, p); conn.close(); corpo = {'versao': versao, 'completo': True, 'eventos': evs, 'removidos': []}
+    else:
+        corpo = eventos_calendario(conn, w, p); conn.close()
+    resp = jsonify(corpo); resp.set_etag(tag, weak=True); resp.headers['Cache-Control'] = 'no-cache'; resp.headers['X-Agenda-Versao'] = str(versao); return resp
+
+CORES_STATUS = {'Agendado':'#F59E0B','Confirmado':'#3B82F6','Realizado':'#10B981','NoShow':'#EF4444','Em Espera':'#8B5CF6','Em Atendimento':'#EC4899'}
+
+def eventos_calendario(conn, where, params):
+    evs = []
+    for r in conn.execute("SELECT a.id, a.data_hora_inicio, a.data_hora_fim, COALESCE(a.status, 'Agendado') as status, p.nome as paciente FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id WHERE " + " AND ".join(where), params).fetchall():
+        st = r['status']; cor = CORES_STATUS.get(st,'#6B7280')
+        evs.append({'id':r['id'],'title':f"{r['paciente']} ({st})",'start':r['data_hora_inicio'],'end':r['data_hora_fim'],'backgroundColor':cor,'borderColor':cor})
+    return evs
+
+def inicio_minimo(conn, ini):
+    """Nada dura mais que a maior duração gravada (MAX pelo idx_ag_duracao): quem termina depois de `ini` começou depois de ini - essa duração.
+    Fecha a janela dos dois lados em idx_ag_inicio; só com o fim, o planner percorre idx_ag_fim até o fim da tabela."""
+    dur = conn.execute("SELECT MAX(julianday(data_hora_fim) - julianday(data_hora_inicio)) FROM agendamentos").fetchone()[0]
+    try: return (datetime.fromisoformat(ini) - timedelta(days=dur or 0)).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError: return None
+
+def data_iso(v):
+    """'2024-01-01T00:00:00-03:00' (formato do FullCalendar) -> '2024-01-01 00:00:00', no mesmo formato gravado no banco."""
+    return v[:19].replace('T', ' ') if v else None
+
+def resposta_304(tag):
+    resp = Response(status=304); resp.set_etag(tag, weak=True); resp.headers['Cache-Control'] = 'no-cache'; return resp
+
+@app.route('/api/eventos/agenda')
+@login_required
+def eventos_agenda():
+    # Retoma de Last-Event-ID (reconexão do EventSource) ou ?desde=; sem nenhum dos dois, começa do momento atual
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None: desde = request.args.get('desde', type=int)
+    if desde is None:
+        with db.conexao() as conn: desde = conn.execute("SELECT COALESCE(MAX(versao), 0) FROM agenda_log").fetchone()[0]
+    # Sem vaga: 503 e o cliente cai no polling de 30s, em vez de um stream prender a última thread livre
+    vagas = canal_agenda.vagas
+    if not vagas.acquire(blocking=False): return jsonify({"erro": "Limite de conexões em tempo real atingido"}), 503, {'Retry-After': '30'}
+    def gerar(versao):
+        limite = time.monotonic() + SSE_DURACAO_MAX; seq = canal_agenda.aguardar(-1, 0)
+        yield f"retry: 3000\nid: {versao}\n\n"
+        while time.monotonic() < limite:
+            with db.conexao() as conn:
+                linhas = conn.execute("SELECT l.versao, l.agendamento_id, l.paciente_id, l.operacao, a.status, a.profissional_id, a.data_hora_inicio, a.data_hora_fim FROM agenda_log l LEFT JOIN agendamentos a ON a.id=l.agendamento_id WHERE l.versao > ? ORDER BY l.versao LIMIT 500", (versao,)).fetchall()
+            for r in linhas:
+                versao = r['versao']; ev = dict(r); ev['operacao'] = OPERACOES_LOG.get(r['operacao'], r['operacao'])
+                yield f"id: {versao}\nevent: agenda\ndata: {json.dumps(ev)}\n\n"
+            if len(linhas) == 500: continue
+            novo = canal_agenda.aguardar(seq, SSE_HEARTBEAT)
+            if novo == seq: yield ": ping\n\n"  # mantém a conexão viva e percebe escritas de outros processos
+            seq = novo
+    resp = Response(stream_with_context(gerar(desde)), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    resp.call_on_close(vagas.release); return resp
+
+def acesso_metricas():
+    # Prometheus raspa sem login: libera a própria máquina; da rede, só logado
+    return current_user.is_authenticated or request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/api/metrics')
+def metrics():
+    if not acesso_metricas(): return login_error()
+    return Response(metricas.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics/sql')
+def metrics_sql():
+    # Consultas lentas recentes (com plano) e as que mais somam tempo
+    if not acesso_metricas(): return login_error()
+    return jsonify(dict(metricas.resumo_sql(), limite_ms=SQL_LENTO_MS))
+
+# --- COMPRESSÃO E RESPOSTAS CONDICIONAIS ---
+TIPOS_COMPRIMIVEIS = ('application/json', 'text/html', 'text/plain', 'text/csv', 'text/css', 'application/javascript')
+COMPRIMIR_MIN = 1024
+_cache_index = {}
+
+def codificacao_aceita():
+    if brotli and request.accept_encodings['br']: return 'br'
+    if request.accept_encodings['gzip']: return 'gzip'
+    return None
+
+def comprimir(dados, enc): return brotli.compress(dados, quality=5) if enc == 'br' else gzip.compress(dados, compresslevel=6)
+
+@app.after_request
+def etag_e_compressao(resp):
+    # Streams (exportação, SSE) e arquivos passam direto
+    if resp.direct_passthrough or resp.is_streamed or 'Content-Encoding' in resp.headers: return resp
+    if request.method == 'GET' and resp.status_code == 200 and request.path.startswith('/api/'):
+        if not resp.get_etag()[0]: resp.add_etag(weak=True)
+        resp.headers.setdefault('Cache-Control', 'private, no-cache'); resp = resp.make_conditional(request)
+    if resp.status_code == 200 and resp.mimetype in TIPOS_COMPRIMIVEIS:
+        resp.vary.add('Accept-Encoding'); enc = codificacao_aceita(); dados = resp.get_data()
+        if enc and len(dados) >= COMPRIMIR_MIN:
+            # ETag forte identifica um único corpo em bytes: comprimido é outra representação, então passa a fraca
+            tag, fraca = resp.get_etag()
+            if tag and not fraca: resp.set_etag(tag, weak=True)
+            resp.set_data(comprimir(dados, enc)); resp.headers['Content-Encoding'] = enc
+    return resp
 
 @app.route('/api/sala_espera')
 @login_required
 def sala_espera():
     conn=db.conectar()
-    ini = datetime.now().strftime("%Y-%m-%d 00:00:00")
-    fim = datetime.now().strftime("%Y-%m-%d 23:59:59")
-    r=[dict(x) for x in conn.execute("SELECT a.*, p.nome as paciente_nome, p.telefone_principal as paciente_tel, pr.nome as profissional_nome, s.nome as sala_nome FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id LEFT JOIN profissionais pr ON a.profissional_id=pr.id LEFT JOIN salas s ON a.sala_id=s.id WHERE a.data_hora_inicio BETWEEN ? AND ? ORDER BY a.data_hora_inicio ASC", (ini, fim)).fetchall()]
+    ini, fim = intervalo_hoje()
+    r=[dict(x) for x in conn.execute("SELECT a.*, p.nome as paciente_nome, p.telefone_principal as paciente_tel, pr.nome as profissional_nome, s.nome as sala_nome FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id LEFT JOIN profissionais pr ON a.profissional_id=pr.id LEFT JOIN salas s ON a.sala_id=s.id WHERE a.data_hora_inicio >= ? AND a.data_hora_inicio < ? ORDER BY a.data_hora_inicio ASC", (ini, fim)).fetchall()]
     conn.close(); return jsonify(r)
 
 @app.route('/api/pacientes', methods=['GET'])
 @login_required
-def list_pac(): f=request.args.get('filtro',''); conn=db.conectar(); r=[dict(x) for x in conn.execute(f"SELECT * FROM pacientes WHERE nome LIKE '%{f}%' OR cpf LIKE '%{f}%' ORDER BY nome").fetchall()]; conn.close(); return jsonify(r)
+def list_pac():
+    # Projeção compacta (sem os campos de texto longos) + FTS com prefixo; ?limit=&cursor= para busca incremental
+    termo = termo_fts(request.args.get('filtro', '')); limite = request.args.get('limit', type=int); cur = decodificar_cursor(request.args.get('cursor'))
+    q = "SELECT p.id, p.nome, p.cpf, p.telefone_principal, p.email, p.data_nascimento, p.convenio_id, p.ativo FROM pacientes p"; w = []; params = []
+    if termo: q += " JOIN pacientes_fts f ON f.rowid=p.id"; w.append("pacientes_fts MATCH ?"); params.append(termo)
+    if cur: w.append("(p.nome, p.id) > (?, ?)"); params += cur
+    if w: q += " WHERE " + " AND ".join(w)
+    q += " ORDER BY p.nome, p.id"
+    if limite: q += " LIMIT ?"; params.append(limite)
+    conn=db.conectar(); r=[dict(x) for x in conn.execute(q, params).fetchall()]; conn.close(); resp = jsonify(r)
+    if limite and len(r) == limite: resp.headers['X-Proximo-Cursor'] = codificar_cursor(r[-1]['nome'], r[-1]['id'])
+    return resp
 @app.route('/api/pacientes/salvar', methods=['POST'])
 @login_required
 def save_pac():
-    d=request.json; conn=db.conectar(); end=json.dumps(d.get('endereco',{})); resp=json.dumps(d.get('responsavel',{}))
-    v=(d['nome'],d.get('cpf'),d.get('rg'),d.get('nasc'),d.get('sexo'),d.get('tel'),d.get('email'),end,d.get('conv'),d.get('obs'),d.get('meds'),resp)
+    d=request.json; conn=db.conectar(); v=valores_paciente(d)
     if d.get('id'): conn.execute("UPDATE pacientes SET nome=?, cpf=?, rg=?, data_nascimento=?, sexo=?, telefone_principal=?, email=?, endereco=?, convenio_id=?, observacoes_medicas=?, medicamentos_em_uso=?, responsavel=? WHERE id=?", v+(d['id'],))
-    else: conn.execute("INSERT INTO pacientes (nome, cpf, rg, data_nascimento, sexo, telefone_principal, email, endereco, convenio_id, observacoes_medicas, medicamentos_em_uso, responsavel) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", v)
+    else: conn.execute(SQL_INS_PACIENTE, v)
     conn.commit(); conn.close(); return jsonify({"msg":"Salvo"})
 
+SQL_INS_PACIENTE = "INSERT INTO pacientes (nome, cpf, rg, data_nascimento, sexo, telefone_principal, email, endereco, convenio_id, observacoes_medicas, medicamentos_em_uso, responsavel) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"
+def valores_paciente(d):
+    end=json.dumps(d.get('endereco',{})); resp=json.dumps(d.get('responsavel',{}))
+    return (d['nome'],d.get('cpf'),d.get('rg'),d.get('nasc'),d.get('sexo'),d.get('tel'),d.get('email'),end,d.get('conv'),d.get('obs'),d.get('meds'),resp)
+
 @app.route('/api/profissionais', methods=['GET'])
 @login_required
-def list_prof(): conn=db.conectar(); r=[dict(x) for x in conn.execute("SELECT p.*, e.nome as esp_nome FROM profissionais p LEFT JOIN especialidades e ON p.especialidade_id=e.id ORDER BY p.nome").fetchall()]; conn.close(); return jsonify(r)
+def list_prof(): conn=db.conectar(); r=listar_keyset(conn, "profissionais p LEFT JOIN especialidades e ON p.especialidade_id=e.id", dict(colunas_tabela(conn, 'profissionais', 'p'), esp_nome='e.nome'), ['nome', 'id']); conn.close(); return r
 @app.route('/api/profissionais/salvar', methods=['POST'])
 @login_required
+@invalida_dashboard
 def save_prof():
-    d=request.json; conn=db.conectar(); disp=json.dumps(d.get('dias',[])); end=json.dumps(d.get('endereco',{})); bank=json.dumps(d.get('banco',{}))
-    v=(d['nome'],d.get('crm'),d.get('cpf'),d.get('nasc'),d.get('esp_id'),d.get('email'),d.get('tel'),end,bank,d.get('cor','#10B981'),d.get('comissao',0),d.get('bio'),disp,d.get('ativo',1))
+    d=request.json; conn=db.conectar(); v=valores_profissional(d)
     if d.get('id'): conn.execute("UPDATE profissionais SET nome=?, crm=?, cpf=?, data_nascimento=?, especialidade_id=?, email=?, telefone=?, endereco=?, dados_bancarios=?, cor_agenda=?, comissao=?, bio=?, disponibilidade=?, ativo=? WHERE id=?", v+(d['id'],))
-    else: conn.execute("INSERT INTO profissionais (nome, crm, cpf, data_nascimento, especialidade_id, email, telefone, endereco, dados_bancarios, cor_agenda, comissao, bio, disponibilidade, ativo) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)", v)
+    else: conn.execute(SQL_INS_PROFISSIONAL, v)
     conn.commit(); conn.close(); return jsonify({"msg":"Salvo"})
 
+SQL_INS_PROFISSIONAL = "INSERT INTO profissionais (nome, crm, cpf, data_nascimento, especialidade_id, email, telefone, endereco, dados_bancarios, cor_agenda, comissao, bio, disponibilidade, ativo) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+def valores_profissional(d):
+    dias=d.get('dias',[]); disp=dias if isinstance(dias, str) else json.dumps(dias); end=json.dumps(d.get('endereco',{})); bank=json.dumps(d.get('banco',{}))
+    return (d['nome'],d.get('crm'),d.get('cpf'),d.get('nasc'),d.get('esp_id'),d.get('email'),d.get('tel'),end,bank,d.get('cor') or '#10B981',d.get('comissao') or 0,d.get('bio'),disp,d.get('ativo',1))
+
 @app.route('/api/agenda', methods=['GET'])
 @login_required
 def list_ag():
-    hoje = datetime.now().strftime('%Y-%m-%d'); dt_ini = request.args.get('inicio', hoje); dt_fim = request.args.get('fim', hoje); prof = request.args.get('prof_id'); conn = db.conectar(); q = "SELECT a.*, p.nome as paciente, pr.nome as profissional FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id JOIN profissionais pr ON a.profissional_id=pr.id WHERE DATE(a.data_hora_inicio) BETWEEN ? AND ?"; p = [dt_ini, dt_fim]
+    hoje = datetime.now().strftime('%Y-%m-%d'); dt_ini = request.args.get('inicio', hoje); dt_fim = request.args.get('fim', hoje); prof = request.args.get('prof_id'); conn = db.conectar(); q = "SELECT a.*, p.nome as paciente, pr.nome as profissional FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id JOIN profissionais pr ON a.profissional_id=pr.id WHERE a.data_hora_inicio >= ? AND a.data_hora_inicio < ?"; p = list(intervalo_dias(dt_ini, dt_fim))
     if prof: q+=" AND a.profissional_id=?"; p.append(prof)
     r=[dict(x) for x in conn.execute(q+" ORDER BY a.data_hora_inicio", p).fetchall()]; conn.close(); return jsonify(r)
 
 @app.route('/api/agenda/salvar', methods=['POST'])
 @login_required
+@invalida_dashboard
+@notifica_agenda
 def save_ag():
     d = request.json; conn = db.conectar()
     if not d.get('paciente_id') or not d.get('profissional_id') or not d.get('data') or not d.get('hora'):
@@ -242,12 +1049,9 @@ def save_ag():
     fim = ini + timedelta(minutes=int(d.get('duracao', 30)))
     istr, fstr = ini.strftime("%Y-%m-%d %H:%M:%S"), fim.strftime("%Y-%m-%d %H:%M:%S")
     
-    # BLOQUEIO DE HORÁRIO DUPLICADO
-    check = "SELECT id FROM agendamentos WHERE profissional_id=? AND status!='Cancelado' AND data_hora_inicio < ? AND data_hora_fim > ?"
-    params = [d['profissional_id'], fstr, istr]
-    if d.get('id'): check += " AND id!=?"; params.append(d['id'])
-    
-    if conn.execute(check, params).fetchone():
+    # BLOQUEIO DE HORÁRIO DUPLICADO (BEGIN IMMEDIATE: dois balcões não passam juntos pela checagem)
+    conn.execute("BEGIN IMMEDIATE")
+    if db.agenda.conflito(d['profissional_id'], ini, fim, d.get('id')):
         conn.close(); return jsonify({"erro":"Horário indisponível"}), 409
 
     # CORREÇÃO: INCLUINDO 'Agendado' COMO STATUS PADRÃO
@@ -257,20 +1061,28 @@ def save_ag():
         # No update não forçamos 'Agendado' se já tiver status, mas aqui atualizamos tudo
         conn.execute("UPDATE agendamentos SET paciente_id=?, profissional_id=?, data_hora_inicio=?, duracao_minutos=?, data_hora_fim=?, status=?, tipo=?, observacoes=?, sala_id=? WHERE id=?", v+(d['id'],))
     else: 
-        conn.execute("INSERT INTO agendamentos (paciente_id, profissional_id, data_hora_inicio, duracao_minutos, data_hora_fim, status, tipo, observacoes, sala_id) VALUES (?,?,?,?,?,?,?,?,?)", v)
+        conn.execute(SQL_INS_AGENDAMENTO, v)
     
     conn.commit(); conn.close(); return jsonify({"msg":"Ok"})
 
+SQL_INS_AGENDAMENTO = "INSERT INTO agendamentos (paciente_id, profissional_id, data_hora_inicio, duracao_minutos, data_hora_fim, status, tipo, observacoes, sala_id) VALUES (?,?,?,?,?,?,?,?,?)"
+
 @app.route('/api/agenda/deletar/<int:id>', methods=['DELETE'])
 @login_required
+@invalida_dashboard
+@notifica_agenda
 def del_ag(id): conn=db.conectar(); conn.execute("DELETE FROM agendamentos WHERE id=?",(id,)); conn.commit(); conn.close(); return jsonify({"msg":"Deletado"})
 @app.route('/api/agenda/status', methods=['POST'])
 @login_required
+@invalida_dashboard
+@notifica_agenda
 def st_ag(): conn=db.conectar(); conn.execute("UPDATE agendamentos SET status=? WHERE id=?",(request.json['status'],request.json['id'])); conn.commit(); conn.close(); return jsonify({"msg":"Ok"})
 @app.route('/api/agenda/iniciar_atendimento_paciente', methods=['POST'])
 @login_required
+@invalida_dashboard
+@notifica_agenda
 def ini_atend_pac():
-    d=request.json; h=datetime.now().strftime("%Y-%m-%d"); conn=db.conectar(); ag = conn.execute("SELECT id FROM agendamentos WHERE paciente_id=? AND data_hora_inicio BETWEEN ? AND ? AND status NOT IN ('Cancelado','Finalizado')", (d['id'], f"{h} 00:00:00", f"{h} 23:59:59")).fetchone()
+    d=request.json; h_ini, h_fim=intervalo_hoje(); conn=db.conectar(); ag = conn.execute("SELECT id FROM agendamentos WHERE paciente_id=? AND data_hora_inicio >= ? AND data_hora_inicio < ? AND status NOT IN ('Cancelado','Finalizado')", (d['id'], h_ini, h_fim)).fetchone()
     if ag: conn.execute("UPDATE agendamentos SET status='Em Atendimento' WHERE id=?", (ag['id'],))
     else:
         prof_id = d.get('prof_id')
@@ -279,47 +1091,231 @@ def ini_atend_pac():
     conn.commit(); conn.close(); return jsonify({"msg": "Atualizado"})
 @app.route('/api/agendamento/transferir', methods=['POST'])
 @login_required
+@invalida_dashboard
+@notifica_agenda
 def tr_ag():
-    d=request.json; conn=db.conectar(); ini=datetime.strptime(f"{d['data']} {d['hora']}","%Y-%m-%d %H:%M"); fim=ini+timedelta(minutes=30); istr,fstr=ini.strftime("%Y-%m-%d %H:%M:%S"),fim.strftime("%Y-%m-%d %H:%M:%S")
-    if conn.execute("SELECT id FROM agendamentos WHERE profissional_id=? AND status!='Cancelado' AND id!=? AND ((data_hora_inicio<? AND data_hora_fim>?) OR (data_hora_inicio>=? AND data_hora_fim<=?))", (d['profissional_id'],d['id'],fstr,istr,istr,fstr)).fetchone(): conn.close(); return jsonify({"erro":"Indisponível"}),409
+    d=request.json; conn=db.conectar(); conn.execute("BEGIN IMMEDIATE"); ag=conn.execute("SELECT duracao_minutos FROM agendamentos WHERE id=?",(d['id'],)).fetchone()
+    dur=int(d.get('duracao') or (ag and ag['duracao_minutos']) or 30); ini=datetime.strptime(f"{d['data']} {d['hora']}","%Y-%m-%d %H:%M"); fim=ini+timedelta(minutes=dur); istr,fstr=ini.strftime("%Y-%m-%d %H:%M:%S"),fim.strftime("%Y-%m-%d %H:%M:%S")
+    if db.agenda.conflito(d['profissional_id'], ini, fim, d['id']): conn.close(); return jsonify({"erro":"Indisponível"}),409
     conn.execute("UPDATE agendamentos SET profissional_id=?, data_hora_inicio=?, data_hora_fim=?, status='Agendado' WHERE id=?",(d['profissional_id'],istr,fstr,d['id'])); conn.commit(); conn.close(); return jsonify({"msg":"Ok"})
 
+def data_hora_param(data, hora):
+    try: return datetime.strptime(f"{data} {hora}", "%Y-%m-%d %H:%M")
+    except (TypeError, ValueError): return None
+
+def erro_data_hora(): return jsonify({"erro": f"Use data=AAAA-MM-DD, hora=HH:MM e duracao entre 1 e {DURACAO_MAX} minutos"}), 400
+
+@app.route('/api/disponibilidade', methods=['GET'])
+@login_required
+def disponibilidade():
+    # Próximos N horários livres: ?prof_id= (vazio = todos os ativos) &data=&hora= (padrão: agora) &duracao=30 &n=10 &dias=14
+    agora = datetime.now(); dur = request.args.get('duracao', 30, type=int); prof = request.args.get('prof_id')
+    n = min(request.args.get('n', 10, type=int), DISPONIBILIDADE_MAX_N); dias = min(request.args.get('dias', 14, type=int), DISPONIBILIDADE_MAX_DIAS)
+    desde = data_hora_param(request.args.get('data', agora.strftime('%Y-%m-%d')), request.args.get('hora', agora.strftime('%H:%M')))
+    if desde is None or not 0 < dur <= DURACAO_MAX: return erro_data_hora()
+    conn = db.conectar(); q = "SELECT id, nome, disponibilidade FROM profissionais WHERE ativo=1"; p = []
+    if prof: q += " AND id=?"; p.append(prof)
+    profs = conn.execute(q, p).fetchall(); conn.close(); r = []
+    for pr in profs:
+        for t in db.agenda.proximos_livres(pr['id'], parse_disponibilidade(pr['disponibilidade']), desde, dur, n, dias):
+            r.append({'profissional_id': pr['id'], 'profissional': pr['nome'], 'inicio': t.strftime("%Y-%m-%d %H:%M:%S"), 'fim': (t + timedelta(minutes=dur)).strftime("%Y-%m-%d %H:%M:%S")})
+    r.sort(key=lambda x: (x['inicio'], x['profissional'])); return jsonify(r[:n])
+
+@app.route('/api/disponibilidade/livres', methods=['GET'])
+@login_required
+def livres_no_horario():
+    # Quem está livre em ?data=&hora=&duracao=30 (dentro da grade de cada um)
+    ini = data_hora_param(request.args.get('data'), request.args.get('hora')); dur = request.args.get('duracao', 30, type=int)
+    if ini is None or not 0 < dur <= DURACAO_MAX: return erro_data_hora()
+    fim = ini + timedelta(minutes=dur)
+    conn = db.conectar(); profs = conn.execute("SELECT id, nome, disponibilidade FROM profissionais WHERE ativo=1 ORDER BY nome").fetchall(); conn.close(); r = []
+    for pr in profs:
+        grade = parse_disponibilidade(pr['disponibilidade']).get(ini.weekday(), [])
+        if any(datetime.combine(ini.date(), a) <= ini and fim <= datetime.combine(ini.date(), b) for a, b in grade) and not db.agenda.conflito(pr['id'], ini, fim):
+            r.append({'id': pr['id'], 'nome': pr['nome']})
+    return jsonify(r)
+
 @app.route('/api/financeiro/<t>', methods=['GET'])
 @login_required
 def list_fin(t):
-    conn=db.conectar(); r=[]
-    if t=='caixa': r=conn.execute("SELECT * FROM caixa ORDER BY data_hora DESC LIMIT 100").fetchall()
-    elif t=='receber': r=conn.execute("SELECT c.*, p.nome as pessoa FROM contas_receber c LEFT JOIN pacientes p ON c.paciente_id=p.id ORDER BY c.data_vencimento").fetchall()
-    else: r=conn.execute("SELECT c.*, c.fornecedor as pessoa FROM contas_pagar c ORDER BY c.data_vencimento").fetchall()
-    conn.close(); return jsonify([dict(x) for x in r])
+    # ?limit=&cursor=&campos= (ver listar_keyset); o caixa continua vindo em páginas de 100 do mais recente para o mais antigo
+    conn=db.conectar()
+    if t=='caixa': resp=listar_keyset(conn, "caixa x", colunas_tabela(conn, 'caixa', 'x'), ['data_hora', 'id'], desc=True, limite_padrao=100)
+    elif t=='receber': resp=listar_keyset(conn, "contas_receber c LEFT JOIN pacientes p ON c.paciente_id=p.id", dict(colunas_tabela(conn, 'contas_receber', 'c'), pessoa='p.nome'), ['data_vencimento', 'id'])
+    else: resp=listar_keyset(conn, "contas_pagar c", dict(colunas_tabela(conn, 'contas_pagar', 'c'), pessoa='c.fornecedor'), ['data_vencimento', 'id'])
+    conn.close(); return resp
 
 @app.route('/api/financeiro/salvar', methods=['POST'])
 @login_required
+@invalida_dashboard
 def save_fin():
     try:
         d = request.json; conn = db.conectar()
         if not d.get('valor') or not d.get('venc') or not d.get('cat'):
             return jsonify({"erro": "Preencha Valor, Vencimento e Categoria"}), 400
         
-        t = d['tipo']
-        parc = int(d.get('parc', 1) or 1)
-        val_str = str(d['valor']).replace(',', '.')
-        val = float(val_str) / parc
-        dt = datetime.strptime(d['venc'], "%Y-%m-%d")
-        
-        for i in range(parc):
-            venc = (dt + timedelta(days=30*i)).strftime("%Y-%m-%d")
-            desc = f"{d['desc']} ({i+1}/{parc})" if parc > 1 else d['desc']
-            params = (d.get('paciente_id') if t == 'receber' else d.get('fornecedor'), desc, val, venc, d['cat'], d.get('cc', ''), d.get('forma', ''), parc, i+1)
-            if t == 'receber': conn.execute("INSERT INTO contas_receber (paciente_id, descricao, valor_total, data_vencimento, categoria, centro_custo, forma_pagamento, parcelas, parcela_atual) VALUES (?,?,?,?,?,?,?,?,?)", params)
-            else: conn.execute("INSERT INTO contas_pagar (fornecedor, descricao, valor_total, data_vencimento, categoria, centro_custo, forma_pagamento, parcelas, parcela_atual) VALUES (?,?,?,?,?,?,?,?,?)", params)
+        sql, linhas = parcelas_financeiro(d)
+        conn.executemany(sql, linhas)
         conn.commit(); conn.close()
         return jsonify({"msg": "Ok"})
     except Exception as e:
         return jsonify({"erro": str(e)}), 500
 
+SQL_INS_FIN = {
+    'receber': "INSERT INTO contas_receber (paciente_id, descricao, valor_total, data_vencimento, categoria, centro_custo, forma_pagamento, parcelas, parcela_atual) VALUES (?,?,?,?,?,?,?,?,?)",
+    'pagar': "INSERT INTO contas_pagar (fornecedor, descricao, valor_total, data_vencimento, categoria, centro_custo, forma_pagamento, parcelas, parcela_atual) VALUES (?,?,?,?,?,?,?,?,?)",
+}
+def parcelas_financeiro(d):
+    """Lançamento -> (sql, [params por parcela]); parcelas a cada 30 dias a partir do vencimento."""
+    t = 'receber' if d['tipo'] == 'receber' else 'pagar'
+    parc = int(d.get('parc', 1) or 1)
+    val_str = str(d['valor']).replace(',', '.')
+    val = float(val_str) / parc
+    dt = datetime.strptime(d['venc'], "%Y-%m-%d"); linhas = []
+    for i in range(parc):
+        venc = (dt + timedelta(days=30*i)).strftime("%Y-%m-%d")
+        desc = f"{d['desc']} ({i+1}/{parc})" if parc > 1 else d['desc']
+        linhas.append((d.get('paciente_id') if t == 'receber' else d.get('fornecedor'), desc, val, venc, d['cat'], d.get('cc') or '', d.get('forma') or '', parc, i+1))
+    return SQL_INS_FIN[t], linhas
+
+# --- IMPORTAÇÃO EM LOTE ---
+# JSON (array ou {"itens": [...]}) ou CSV (corpo text/csv ou upload "arquivo"), com os mesmos campos dos endpoints /salvar.
+# Linhas válidas entram num único executemany/transação; as inválidas voltam em "erros" com o número da linha.
+IMPORT_MAX_RECORRENCIA = 520
+RECORRENCIAS = {'diaria': 1, 'semanal': 7, 'quinzenal': 14}
+
+def linhas_importacao():
+    arq = request.files.get('arquivo')
+    if arq is None and request.is_json:
+        dados = request.get_json(); dados = dados.get('itens', []) if isinstance(dados, dict) else dados
+        if not isinstance(dados, list): raise ValueError("esperada uma lista de registros (ou {\"itens\": [...]})")
+        return dados
+    texto = arq.read().decode('utf-8-sig') if arq else request.get_data(as_text=True).lstrip('\ufeff')
+    cab = texto.split('\n', 1)[0]; sep = ';' if cab.count(';') > cab.count(',') else ','
+    return [{k.strip(): (v.strip() if v and v.strip() else None) for k, v in r.items() if k} for r in csv.DictReader(io.StringIO(texto), delimiter=sep)]
+
+def exigir(d, *campos):
+    if not isinstance(d, dict): raise TypeError("Registro inválido: esperado um objeto com os campos")
+    faltando = [c for c in campos if not d.get(c)]
+    if faltando: raise ValueError(f"Campo(s) obrigatório(s): {', '.join(faltando)}")
+
+# Leitura de campos com mensagem legível por campo (em vez do texto cru do int()/float()/strptime())
+def campo_int(d, campo, padrao=None, minimo=None):
+    v = d.get(campo)
+    if v is None or v == '': return padrao
+    try: n = int(v)
+    except (TypeError, ValueError): raise ValueError(f"{campo} deve ser um número inteiro (recebido: {v})") from None
+    if minimo is not None and n < minimo: raise ValueError(f"{campo} deve ser no mínimo {minimo} (recebido: {v})")
+    return n
+
+def campo_valor(d, campo):
+    v = d.get(campo)
+    try: return float(str(v).replace(',', '.'))
+    except ValueError: raise ValueError(f"{campo} deve ser um valor numérico (recebido: {v})") from None
+
+def campo_data(d, campo):
+    try: return datetime.strptime(str(d.get(campo)), "%Y-%m-%d")
+    except ValueError: raise ValueError(f"{campo} deve ser uma data AAAA-MM-DD (recebido: {d.get(campo)})") from None
+
+def campo_data_hora(d):
+    try: return datetime.strptime(f"{d.get('data')} {d.get('hora')}", "%Y-%m-%d %H:%M")
+    except ValueError: raise ValueError(f"data/hora devem ser AAAA-MM-DD e HH:MM (recebido: {d.get('data')} {d.get('hora')})") from None
+
+def referencias(conn, itens, mapa):
+    """{campo: (tabela, ids existentes)} dos ids citados no lote: uma consulta por tabela referenciada, não uma por linha."""
+    refs = {}
+    for campo, tabela in mapa.items():
+        citados = {int(d[campo]) for d in itens if isinstance(d, dict) and str(d.get(campo, '')).isdigit()}
+        refs[campo] = (tabela, {r[0] for r in conn.execute(f"SELECT id FROM {tabela} WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(sorted(citados)),))})
+    return refs
+
+def checar_referencias(d, refs):
+    for campo, (tabela, ids) in refs.items():
+        v = campo_int(d, campo)
+        if v is not None and v not in ids: raise ValueError(f"{campo} {v} não existe em {tabela}")
+
+def datas_recorrencia(ini, d):
+    """Expande repetir=diaria|semanal|quinzenal|mensal com vezes=N e/ou ate=AAAA-MM-DD. Sem repetir, só a data original."""
+    rep = (d.get('repetir') or '').lower()
+    if not rep: return [ini]
+    if rep != 'mensal' and rep not in RECORRENCIAS: raise ValueError(f"repetir inválido: {rep}")
+    ate = campo_data(d, 'ate') + timedelta(days=1) if d.get('ate') else None
+    vezes = min(campo_int(d, 'vezes', IMPORT_MAX_RECORRENCIA, minimo=1), IMPORT_MAX_RECORRENCIA)
+    if not ate and not d.get('vezes'): raise ValueError("Recorrência precisa de vezes ou ate")
+    datas = []
+    for i in range(vezes):
+        if rep == 'mensal':
+            m = ini.month - 1 + i; ano, mes = ini.year + m // 12, m % 12 + 1
+            ult = ((datetime(ano, mes, 28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)).day
+            t = ini.replace(year=ano, month=mes, day=min(ini.day, ult))
+        else: t = ini + timedelta(days=RECORRENCIAS[rep] * i)
+        if ate and t >= ate: break
+        datas.append(t)
+    return datas
+
+REFS_AGENDAMENTO = {'paciente_id': 'pacientes', 'profissional_id': 'profissionais', 'sala_id': 'salas'}
+
+def importar_agendamentos(conn, itens):
+    # Checa referências, conflito contra a agenda (índice) e contra as próprias linhas do lote
+    conn.execute("BEGIN IMMEDIATE"); lote = {}; linhas = []; erros = []; refs = referencias(conn, itens, REFS_AGENDAMENTO)
+    for n, d in enumerate(itens, 1):
+        try:
+            exigir(d, 'paciente_id', 'profissional_id', 'data', 'hora'); checar_referencias(d, refs)
+            dur = campo_int(d, 'duracao', 30, minimo=1); prof = campo_int(d, 'profissional_id'); novas = []
+            for ini in datas_recorrencia(campo_data_hora(d), d):
+                fim = ini + timedelta(minutes=dur); lst = lote.setdefault(prof, []); i = bisect.bisect_left(lst, (fim,))
+                if (i > 0 and lst[i-1][1] > ini) or db.agenda.conflito(prof, ini, fim): raise ValueError(f"Horário indisponível em {ini.strftime('%d/%m/%Y %H:%M')}")
+                novas.append((ini, fim))
+            for ini, fim in novas:
+                bisect.insort(lote[prof], (ini, fim))
+                linhas.append((d['paciente_id'], prof, ini.strftime("%Y-%m-%d %H:%M:%S"), dur, fim.strftime("%Y-%m-%d %H:%M:%S"), 'Agendado', d.get('tipo'), d.get('obs'), d.get('sala_id')))
+        except (KeyError, ValueError, TypeError) as e: erros.append({'linha': n, 'erro': str(e)})
+    return [(SQL_INS_AGENDAMENTO, linhas)], erros
+
+def importar_simples(montar, mapa_refs=None):
+    def importar(conn, itens):
+        grupos = {}; erros = []; refs = referencias(conn, itens, mapa_refs or {})
+        for n, d in enumerate(itens, 1):
+            try:
+                sql, linhas = montar(d); checar_referencias(d, refs); grupos.setdefault(sql, []).extend(linhas)
+            except (KeyError, ValueError, TypeError) as e: erros.append({'linha': n, 'erro': str(e) if not isinstance(e, KeyError) else f"Campo obrigatório: {e.args[0]}"})
+        return list(grupos.items()), erros
+    return importar
+
+def _montar_pac(d): exigir(d, 'nome'); return SQL_INS_PACIENTE, [valores_paciente(d)]
+def _montar_prof(d): exigir(d, 'nome'); return SQL_INS_PROFISSIONAL, [valores_profissional(d)]
+def _montar_fin(d):
+    exigir(d, 'tipo', 'valor', 'venc', 'cat', 'desc')
+    if d['tipo'] not in ('receber', 'pagar'): raise ValueError(f"tipo deve ser receber ou pagar (recebido: {d['tipo']})")
+    campo_valor(d, 'valor'); campo_data(d, 'venc'); campo_int(d, 'parc', 1, minimo=1)
+    return parcelas_financeiro(d)
+
+IMPORTADORES = {
+    'pacientes': importar_simples(_montar_pac, {'conv': 'convenios'}),
+    'profissionais': importar_simples(_montar_prof, {'esp_id': 'especialidades'}),
+    'agendamentos': importar_agendamentos,
+    'financeiro': importar_simples(_montar_fin, {'paciente_id': 'pacientes'}),
+}
+
+@app.route('/api/importar/<tipo>', methods=['POST'])
+@login_required
+@invalida_dashboard
+@notifica_agenda
+def importar(tipo):
+    # ?validar=1 só valida e devolve o relatório, sem gravar
+    if tipo not in IMPORTADORES: return jsonify({"erro": "Importação inválida"}), 404
+    try: itens = linhas_importacao()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e: return jsonify({"erro": f"Arquivo inválido: {e}"}), 400
+    with db.conexao() as conn:
+        grupos, erros = IMPORTADORES[tipo](conn, itens)
+        if request.args.get('validar'): conn.rollback()
+        else:
+            for sql, linhas in grupos: conn.executemany(sql, linhas)
+    return jsonify({"total": len(itens), "inseridos": sum(len(l) for _, l in grupos), "erros": erros, "gravado": not request.args.get('validar')})
+
 @app.route('/api/financeiro/baixar', methods=['POST'])
 @login_required
+@invalida_dashboard
 def baixa_fin():
     d=request.json; conn=db.conectar(); tab=f"contas_{d['tipo']}"; c=conn.execute(f"SELECT * FROM {tab} WHERE id=?",(d['id'],)).fetchone()
     np=float(c['valor_pago'])+float(d['valor_pago']); st='Pago' if np>=float(c['valor_total'])-0.1 else 'Parcial'; conn.execute(f"UPDATE {tab} SET status=?, valor_pago=?, data_pagamento=? WHERE id=?",(st,np,datetime.now().strftime("%Y-%m-%d"),d['id'])); conn.execute("INSERT INTO caixa (tipo, valor, descricao, usuario, referencia_id) VALUES (?,?,?,?,?)",('Entrada' if d['tipo']=='receber' else 'Saída', d['valor_pago'], f"Baixa: {c['descricao']}", current_user.username, d['id'])); conn.commit(); conn.close(); return jsonify({"msg":"Ok"})
@@ -328,7 +1324,7 @@ def baixa_fin():
 @login_required
 def list_ax(t): 
     if t not in ['especialidades','salas','procedimentos','convenios']: return jsonify([])
-    conn=db.conectar(); r=[dict(x) for x in conn.execute(f"SELECT * FROM {t} ORDER BY nome").fetchall()]; conn.close(); return jsonify(r)
+    conn=db.conectar(); r=listar_keyset(conn, f"{t} x", colunas_tabela(conn, t, 'x'), ['nome', 'id']); conn.close(); return r
 @app.route('/api/auxiliares/<t>/salvar', methods=['POST'])
 @login_required
 def save_ax(t): conn=db.conectar(); conn.execute(f"INSERT INTO {t} (nome) VALUES (?)",(request.json['nome'],)); conn.commit(); conn.close(); return jsonify({"msg":"Ok"})
@@ -350,38 +1346,111 @@ def save_conv():
 def del_conv(id): conn=db.conectar(); conn.execute("DELETE FROM convenios WHERE id=?",(id,)); conn.commit(); conn.close(); return jsonify({"msg":"Ok"})
 @app.route('/api/prontuario/<int:id>', methods=['GET'])
 @login_required
-def list_pr(id): conn=db.conectar(); r=[dict(x) for x in conn.execute("SELECT p.*, prof.nome as profissional FROM prontuarios p JOIN profissionais prof ON p.profissional_id=prof.id WHERE p.paciente_id=? ORDER BY p.data_atendimento DESC",(id,)).fetchall()]; conn.close(); return jsonify(r)
+def list_pr(id): conn=db.conectar(); r=listar_keyset(conn, "prontuarios p JOIN profissionais prof ON p.profissional_id=prof.id", dict(colunas_tabela(conn, 'prontuarios', 'p'), profissional='prof.nome'), ['data_atendimento', 'id'], "p.paciente_id=?", (id,), desc=True); conn.close(); return r
 @app.route('/api/prontuario/salvar', methods=['POST'])
 @login_required
 def save_pr(): d=request.json; conn=db.conectar(); conn.execute("INSERT INTO prontuarios (paciente_id, profissional_id, data_atendimento, evolucao_clinica, diagnostico, prescricao, exames_solicitados) VALUES (?,?,?,?,?,?,?)",(d['paciente_id'],d['profissional_id'],datetime.now().strftime("%Y-%m-%d %H:%M"),d['evolucao'],d.get('diagnostico'),d.get('prescricao'),d.get('exames'))); conn.commit(); conn.close(); return jsonify({"msg":"Ok"})
+# --- RELATÓRIOS E EXPORTAÇÃO ---
+# tipo -> função(ini, fim) que devolve (sql, params). O mesmo SQL alimenta o rel() (JSON da tela) e a exportação em streaming.
+RELATORIOS = {
+    'agendamentos': lambda ini, fim: ("SELECT a.data_hora_inicio, p.nome as paciente, pr.nome as profissional, a.status FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id JOIN profissionais pr ON a.profissional_id=pr.id WHERE a.data_hora_inicio >= ? AND a.data_hora_inicio < ? ORDER BY a.data_hora_inicio", intervalo_dias(ini, fim)),
+    'financeiro': lambda ini, fim: ("SELECT data_vencimento as data, descricao, categoria, 'Receita' as tipo, valor_total as valor FROM contas_receber WHERE data_vencimento BETWEEN ? AND ? UNION ALL SELECT data_vencimento as data, descricao, categoria, 'Despesa' as tipo, valor_total as valor FROM contas_pagar WHERE data_vencimento BETWEEN ? AND ? ORDER BY data", (ini, fim, ini, fim)),
+    'profissionais': lambda ini, fim: ("SELECT pr.nome as profissional, COUNT(a.id) as atendimentos, SUM(CASE WHEN a.status='Finalizado' THEN 1 ELSE 0 END) as finalizados FROM agendamentos a JOIN profissionais pr ON a.profissional_id=pr.id WHERE a.data_hora_inicio >= ? AND a.data_hora_inicio < ? GROUP BY pr.nome", intervalo_dias(ini, fim)),
+    'pacientes': lambda ini, fim: ("SELECT nome, cpf, telefone_principal, email, created_at as cadastro FROM pacientes ORDER BY nome", ()),
+    'convenios': lambda ini, fim: ("SELECT c.nome as convenio, COUNT(a.id) as atendimentos FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id JOIN convenios c ON p.convenio_id=c.id WHERE a.data_hora_inicio >= ? AND a.data_hora_inicio < ? GROUP BY c.nome ORDER BY atendimentos DESC", intervalo_dias(ini, fim)),
+    'aniversariantes': lambda ini, fim: ("SELECT nome, strftime('%d/%m', data_nascimento) as dia, telefone_principal FROM pacientes WHERE strftime('%m', data_nascimento) = ? ORDER BY strftime('%d', data_nascimento)", (ini[5:7],)),
+}
+# Exportações antigas de /api/exportar/<tipo> (os aliases mantêm o cabeçalho do CSV de antes)
+EXPORTACOES = {
+    'financeiro': "SELECT data_hora AS Data, tipo AS Tipo, descricao AS Descricao, valor AS Valor FROM caixa ORDER BY data_hora",
+    'pacientes': "SELECT nome AS Nome, cpf AS CPF, telefone_principal AS Tel, email AS Email FROM pacientes ORDER BY nome",
+}
+EXPORT_LOTE = 1000
+
+def linhas_em_lotes(sql, params=()):
+    """Gera listas de até EXPORT_LOTE linhas direto do cursor (a primeira é o cabeçalho), sem materializar o resultado."""
+    with db.conexao() as conn:
+        cur = conn.execute(sql, params); yield [[c[0] for c in cur.description]]
+        while True:
+            lote = cur.fetchmany(EXPORT_LOTE)
+            if not lote: break
+            yield lote
+
+def exportar_stream(sql, params, nome, formato):
+    def csv_chunks():
+        buf = io.StringIO(); w = csv.writer(buf)
+        for lote in linhas_em_lotes(sql, params):
+            w.writerows(tuple(r) for r in lote); yield buf.getvalue(); buf.seek(0); buf.truncate()
+    def ndjson_chunks():
+        lotes = linhas_em_lotes(sql, params); cols = next(lotes)[0]
+        for lote in lotes: yield ''.join(json.dumps(dict(zip(cols, r)), ensure_ascii=False) + '\n' for r in lote)
+    if formato == 'ndjson': return Response(stream_with_context(ndjson_chunks()), mimetype="application/x-ndjson", headers={"Content-disposition": f"attachment; filename={nome}.ndjson"})
+    return Response(stream_with_context(csv_chunks()), mimetype="text/csv", headers={"Content-disposition": f"attachment; filename={nome}.csv"})
+
 @app.route('/api/relatorios/gerar', methods=['POST'])
 @login_required
 def rel():
-    d = request.json; conn = db.conectar(); res = []; ini, fim = d['inicio'], d['fim']
-    if d['tipo'] == 'agendamentos': res = [dict(r) for r in conn.execute("SELECT a.data_hora_inicio, p.nome as paciente, pr.nome as profissional, a.status FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id JOIN profissionais pr ON a.profissional_id=pr.id WHERE DATE(a.data_hora_inicio) BETWEEN ? AND ? ORDER BY a.data_hora_inicio", (ini, fim)).fetchall()]
-    elif d['tipo'] == 'financeiro':
-        r_in = conn.execute("SELECT data_vencimento as data, descricao, categoria, 'Receita' as tipo, valor_total as valor FROM contas_receber WHERE data_vencimento BETWEEN ? AND ?", (ini, fim)).fetchall()
-        r_out = conn.execute("SELECT data_vencimento as data, descricao, categoria, 'Despesa' as tipo, valor_total as valor FROM contas_pagar WHERE data_vencimento BETWEEN ? AND ?", (ini, fim)).fetchall()
-        res = [dict(x) for x in r_in] + [dict(x) for x in r_out]; res.sort(key=lambda x: x['data'])
-    elif d['tipo'] == 'profissionais': res = [dict(r) for r in conn.execute("SELECT pr.nome as profissional, COUNT(a.id) as atendimentos, SUM(CASE WHEN a.status='Finalizado' THEN 1 ELSE 0 END) as finalizados FROM agendamentos a JOIN profissionais pr ON a.profissional_id=pr.id WHERE DATE(a.data_hora_inicio) BETWEEN ? AND ? GROUP BY pr.nome", (ini, fim)).fetchall()]
-    elif d['tipo'] == 'pacientes': res = [dict(r) for r in conn.execute("SELECT nome, cpf, telefone_principal, email, created_at as cadastro FROM pacientes ORDER BY nome").fetchall()]
-    elif d['tipo'] == 'convenios': res = [dict(r) for r in conn.execute("SELECT c.nome as convenio, COUNT(a.id) as atendimentos FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id JOIN convenios c ON p.convenio_id=c.id WHERE DATE(a.data_hora_inicio) BETWEEN ? AND ? GROUP BY c.nome ORDER BY atendimentos DESC", (ini, fim)).fetchall()]
-    elif d['tipo'] == 'aniversariantes': mes = datetime.strptime(ini, "%Y-%m-%d").strftime("%m"); res = [dict(r) for r in conn.execute("SELECT nome, strftime('%d/%m', data_nascimento) as dia, telefone_principal FROM pacientes WHERE strftime('%m', data_nascimento) = ? ORDER BY strftime('%d', data_nascimento)", (mes,)).fetchall()]
-    conn.close(); return jsonify(res)
+    d = request.json
+    if d['tipo'] not in RELATORIOS: return jsonify([])
+    sql, params = RELATORIOS[d['tipo']](d['inicio'], d['fim'])
+    conn = db.conectar(); res = [dict(r) for r in conn.execute(sql, params).fetchall()]; conn.close(); return jsonify(res)
+
+@app.route('/api/relatorios/exportar/<tipo>')
+@login_required
+def exportar_rel(tipo):
+    # ?inicio=&fim= (padrão: hoje) &formato=csv|ndjson
+    if tipo not in RELATORIOS: return jsonify({"erro": "Relatório inválido"}), 404
+    hoje = datetime.now().strftime('%Y-%m-%d'); ini = request.args.get('inicio', hoje); fim = request.args.get('fim', ini)
+    sql, params = RELATORIOS[tipo](ini, fim)
+    return exportar_stream(sql, params, f"relatorio_{tipo}_{ini}_{fim}", request.args.get('formato'))
+
 @app.route('/api/exportar/<tipo>')
 @login_required
 def exportar(tipo):
-    conn=db.conectar(); output=io.StringIO(); writer=csv.writer(output)
-    if tipo=='financeiro': cursor=conn.execute("SELECT data_hora, tipo, descricao, valor FROM caixa"); writer.writerow(['Data','Tipo','Descricao','Valor'])
-    if tipo=='pacientes': cursor=conn.execute("SELECT nome, cpf, telefone_principal, email FROM pacientes"); writer.writerow(['Nome','CPF','Tel','Email'])
-    writer.writerows(cursor.fetchall()); conn.close(); return Response(output.getvalue(), mimetype="text/csv", headers={"Content-disposition": f"attachment; filename={tipo}.csv"})
+    if tipo not in EXPORTACOES: return jsonify({"erro": "Exportação inválida"}), 404
+    return exportar_stream(EXPORTACOES[tipo], (), tipo, request.args.get('formato'))
+
+# --- SERVIDOR ---
+def run_flask(host='0.0.0.0', porta=5000, threads=16, conexoes=200, backlog=1024, keepalive=120):
+    """Serve o app no waitress (WSGI de produção, roda no Windows). Cada stream SSE aberto ocupa uma das threads: no máximo metade delas."""
+    app.config['IP_REDE'] = obter_ip_rede(porta)  # calculado uma vez; o /api/config só lê
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True); db.iniciar()  # migra antes de aceitar conexões
+    db.pool.redimensionar(threads)  # uma conexão guardada por thread de atendimento
+    db.agendar_manutencao()
+    canal_agenda.limitar(max(1, threads // 2))
+    motor_backup.agendar()
+    try: from waitress import serve
+    except ImportError:
+        print("waitress não instalado (pip install waitress): usando o servidor de desenvolvimento do Flask")
+        app.run(host=host, port=porta, threaded=True, use_reloader=False); return
+    serve(app, host=host, port=porta, threads=threads, connection_limit=conexoes, backlog=backlog, channel_timeout=keepalive, ident='ClinicaSys')
 
-def run_flask():
-    app.run(host='0.0.0.0', port=5000, threaded=True, use_reloader=False)
+def abrir_janela(url):
+    import webview  # só o modo com interface precisa do pywebview
+    webview.create_window("ClínicaSys Pro", url, min_size=(1024, 768))
+    webview.start()
+
+def argumentos():
+    p = argparse.ArgumentParser(description="ClínicaSys: servidor + janela (padrão), só servidor (--headless) ou só janela (--cliente URL)")
+    p.add_argument('--headless', action='store_true', help="só o servidor, sem janela (máquina servidora da rede)")
+    p.add_argument('--cliente', metavar='URL', help="só a janela, apontando para um servidor já rodando (ex.: http://192.168.0.10:5000)")
+    p.add_argument('--host', default='0.0.0.0'); p.add_argument('--porta', type=int, default=5000)
+    p.add_argument('--threads', type=int, default=16, help="threads de atendimento do waitress")
+    p.add_argument('--conexoes', type=int, default=200, help="máximo de conexões simultâneas (acima disso ficam na fila)")
+    p.add_argument('--backlog', type=int, default=1024, help="fila de conexões pendentes do socket")
+    p.add_argument('--keepalive', type=int, default=120, help="segundos que uma conexão keep-alive ociosa fica aberta")
+    return p.parse_args()
 
 if __name__ == '__main__':
-    t = threading.Thread(target=run_flask)
-    t.daemon = True
-    t.start()
-    webview.create_window("ClínicaSys Pro", "http://localhost:5000", min_size=(1024, 768))
-    webview.start()
\ No newline at end of file
+    args = argumentos()
+    if args.cliente: abrir_janela(args.cliente)
+    else:
+        opcoes = dict(host=args.host, porta=args.porta, threads=args.threads, conexoes=args.conexoes, backlog=args.backlog, keepalive=args.keepalive)
+        try:
+            if args.headless: run_flask(**opcoes)
+            else:
+                t = threading.Thread(target=run_flask, kwargs=opcoes)
+                t.daemon = True
+                t.start()
+                abrir_janela(f"http://localhost:{args.porta}")
+        finally: db.pool.fechar_todas()  # a última conexão fechada faz o checkpoint e apaga o -wal/-shm
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""Benchmark dos endpoints /api/* do ClínicaSys com o test client do Flask.
+
+Uso:
+  python gerar_dados.py base_teste.db                       # base sintética (uma vez)
+  python benchmark.py base_teste.db --concorrencia 8 --repeticoes 50 --salvar-baseline benchmark_baseline.json
+  python benchmark.py base_teste.db --baseline benchmark_baseline.json   # sai com código 1 se algum p95 piorar além da tolerância
+
+Latência (p50/p95/p99) é medida sem tracemalloc; o pico de memória de cada cenário vem de uma execução extra isolada com tracemalloc.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Rotas que não entram: stream infinito, escrita em disco/banco ou encerram a sessão
+IGNORADAS = {'/api/eventos/agenda', '/api/backup', '/api/backup/iniciar', '/api/backup/download/<nome>', '/api/logout', '/api/login'}
+
+def cenarios(backend, db):
+    hoje = datetime.now(); d = hoje.strftime('%Y-%m-%d'); mes_ini = hoje.replace(day=1).strftime('%Y-%m-%d')
+    ano_ini = (hoje - timedelta(days=365)).strftime('%Y-%m-%d'); sem = (hoje + timedelta(days=7)).strftime('%Y-%m-%d')
+    with db.conexao() as conn:
+        pac = conn.execute("SELECT MIN(id) FROM pacientes").fetchone()[0] or 1
+        pac_pr = (conn.execute("SELECT paciente_id FROM prontuarios ORDER BY id DESC LIMIT 1").fetchone() or [pac])[0]
+        prof = conn.execute("SELECT MIN(id) FROM profissionais").fetchone()[0] or 1
+    prefixos = lambda: random.choice(['an', 'mar', 'silva', 'jo', 'ped', 'souza', 'lu', 'car', '119', '12'])
+    cal = lambda a, b: f"/api/agenda/calendario?start={a}T00:00:00&end={b}T00:00:00"
+    frio = backend.cache_dash.invalidar
+    # (nome, método, url ou função que gera a url, corpo, preparo antes de cada request)
+    lista = [
+        ('dashboard (frio)', 'GET', '/api/dashboard_stats', None, frio),
+        ('dashboard (cache)', 'GET', '/api/dashboard_stats', None, None),
+        ('agenda dia', 'GET', f'/api/agenda?inicio={d}&fim={d}', None, None),
+        ('agenda mês', 'GET', f'/api/agenda?inicio={mes_ini}&fim={d}', None, None),
+        ('agenda mês prof', 'GET', f'/api/agenda?inicio={mes_ini}&fim={d}&prof_id={prof}', None, None),
+        ('calendario mês', 'GET', cal(mes_ini, sem), None, None),
+        ('calendario completo', 'GET', '/api/agenda/calendario', None, None),
+        ('sala_espera', 'GET', '/api/sala_espera', None, None),
+        ('pacientes busca', 'GET', lambda: f'/api/pacientes?limit=50&filtro={prefixos()}', None, None),
+        ('pacientes lista completa', 'GET', '/api/pacientes', None, None),
+        ('profissionais', 'GET', '/api/profissionais', None, None),
+        ('prontuario', 'GET', f'/api/prontuario/{pac_pr}', None, None),
+        ('financeiro receber', 'GET', '/api/financeiro/receber', None, None),
+        ('financeiro pagar', 'GET', '/api/financeiro/pagar', None, None),
+        ('financeiro caixa', 'GET', '/api/financeiro/caixa', None, None),
+        ('auxiliares', 'GET', '/api/auxiliares/especialidades', None, None),
+        ('convenios', 'GET', '/api/convenios', None, None),
+        ('config', 'GET', '/api/config', None, None),
+        ('check_auth', 'GET', '/api/check_auth', None, None),
+        ('disponibilidade', 'GET', f'/api/disponibilidade?data={d}&hora=08:00&n=10', None, None),
+        ('disponibilidade livres', 'GET', f'/api/disponibilidade/livres?data={sem}&hora=14:00', None, None),
+        ('backup status', 'GET', '/api/backup/status', None, None),
+        ('metrics', 'GET', '/api/metrics', None, None),
+        ('metrics sql', 'GET', '/api/metrics/sql', None, None),
+        ('exportar pacientes', 'GET', '/api/exportar/pacientes', None, None),
+        ('exportar caixa', 'GET', '/api/exportar/financeiro', None, None),
+        ('exportar agendamentos ano', 'GET', f'/api/relatorios/exportar/agendamentos?inicio={ano_ini}&fim={d}', None, None),
+    ]
+    for tipo in backend.RELATORIOS:
+        lista.append((f'relatorio {tipo} ano', 'POST', '/api/relatorios/gerar', {'tipo': tipo, 'inicio': ano_ini, 'fim': d}, None))
+    return lista
+
+def rotas_sem_cenario(backend, lista):
+    usadas = {backend.app.url_map.bind('localhost').match(u.split('?')[0] if isinstance(u, str) else u().split('?')[0], method=m)[0] for _, m, u, _, _ in lista}
+    faltando = []
+    for regra in backend.app.url_map.iter_rules():
+        if regra.rule.startswith('/api/') and regra.rule not in IGNORADAS and regra.endpoint not in usadas and 'GET' in regra.methods: faltando.append(regra.rule)
+    return sorted(faltando)
+
+def cliente_logado(backend):
+    c = backend.app.test_client()
+    r = c.post('/api/login', json={'username': os.environ.get('BENCH_USUARIO', 'admin'), 'password': os.environ.get('BENCH_SENHA', 'admin123')})
+    if r.status_code != 200: sys.exit(f"Login falhou: {r.get_json()}")
+    return c
+
+def executar(c, metodo, url, corpo, preparo):
+    if preparo: preparo()
+    u = url() if callable(url) else url
+    t0 = time.perf_counter(); r = c.open(u, method=metodo, json=corpo); r.get_data(); seg = time.perf_counter() - t0
+    return seg, r.status_code
+
+def percentil(v, p):
+    v = sorted(v); k = (len(v) - 1) * p / 100; i = int(k)
+    return v[i] + (v[min(i + 1, len(v) - 1)] - v[i]) * (k - i)
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    p.add_argument('db', help="base a usar (ex.: gerada pelo gerar_dados.py)")
+    p.add_argument('--concorrencia', type=int, default=4); p.add_argument('--repeticoes', type=int, default=20)
+    p.add_argument('--filtro', help="só cenários cujo nome contém este texto")
+    p.add_argument('--baseline', help="compara com este arquivo"); p.add_argument('--tolerancia', type=float, default=0.25, help="piora aceita no p95 (0.25 = 25%%)")
+    p.add_argument('--salvar-baseline', metavar='ARQUIVO'); p.add_argument('--json', metavar='ARQUIVO', help="grava os resultados desta execução")
+    a = p.parse_args()
+    if not os.path.exists(a.db): sys.exit(f"{a.db} não existe (gere com gerar_dados.py)")
+    os.environ['CLINICA_DB'] = os.path.abspath(a.db)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import backend
+
+    lista = [x for x in cenarios(backend, backend.db) if not a.filtro or a.filtro in x[0]]
+    faltando = rotas_sem_cenario(backend, lista) if not a.filtro else []
+    if faltando: print("Rotas GET sem cenário:", ', '.join(faltando))
+    clientes = [cliente_logado(backend) for _ in range(a.concorrencia)]; locais = threading.local()
+    def cliente():
+        if not hasattr(locais, 'c'): locais.c = clientes.pop()
+        return locais.c
+
+    resultados = {}
+    print(f"{'cenário':32} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mem pico':>10}  status")
+    with ThreadPoolExecutor(a.concorrencia) as pool:
+        for nome, metodo, url, corpo, preparo in lista:
+            executar(cliente_logado(backend) if not clientes else clientes[0], metodo, url, corpo, preparo)  # aquecimento (cache de página do SQLite)
+            medidas = list(pool.map(lambda _: executar(cliente(), metodo, url, corpo, preparo), range(a.repeticoes)))
+            c = cliente_logado(backend)  # login (hash da senha) fora do trace: só o pico da rota medida
+            tracemalloc.start(); tracemalloc.reset_peak()
+            executar(c, metodo, url, corpo, preparo); pico = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+            lat = [m[0] * 1000 for m in medidas]; sts = sorted({m[1] for m in medidas})
+            res = {'n': len(lat), 'p50_ms': round(percentil(lat, 50), 2), 'p95_ms': round(percentil(lat, 95), 2), 'p99_ms': round(percentil(lat, 99), 2),
+                   'media_ms': round(statistics.mean(lat), 2), 'mem_pico_kb': round(pico / 1024), 'status': sts}
+            resultados[nome] = res
+            print(f"{nome:32} {res['n']:>5} {res['p50_ms']:>9.1f} {res['p95_ms']:>9.1f} {res['p99_ms']:>9.1f} {res['mem_pico_kb']:>8} KB  {sts}")
+
+    info = {'gerado_em': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'db': os.path.basename(a.db), 'concorrencia': a.concorrencia, 'repeticoes': a.repeticoes, 'cenarios': resultados}
+    for arq in filter(None, (a.salvar_baseline, a.json)):
+        with open(arq, 'w', encoding='utf-8') as f: json.dump(info, f, indent=2, ensure_ascii=False)
+    if a.baseline:
+        with open(a.baseline, encoding='utf-8') as f: base = json.load(f)['cenarios']
+        piores = [(n, base[n]['p95_ms'], r['p95_ms']) for n, r in resultados.items() if n in base and r['p95_ms'] > base[n]['p95_ms'] * (1 + a.tolerancia) and r['p95_ms'] - base[n]['p95_ms'] > 1]
+        for n, antes, agora in piores: print(f"REGRESSÃO {n}: p95 {antes:.1f} ms -> {agora:.1f} ms")
+        if piores: sys.exit(1)
+        print("Sem regressões em relação ao baseline.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Gera uma base sintética no schema atual do ClínicaSys para testes de carga.
+
+Uso: python gerar_dados.py base_teste.db --pacientes 100000 --agendamentos 2000000 --anos 5
+O schema (tabelas, índices, FTS, triggers) vem do próprio backend: Database() + migrações.
+"""
+import argparse
+import itertools
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+NOMES = ['Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela', 'João', 'Juliana', 'Lucas', 'Mariana', 'Mateus', 'Natália', 'Otávio', 'Patrícia', 'Rafael', 'Sofia', 'Thiago', 'Vitória', 'Wagner', 'Yasmin', 'Luíza', 'Gustavo', 'Beatriz', 'Caio', 'Débora', 'Érica', 'Fábio', 'Helena', 'Igor', 'Lara', 'Márcio', 'Renata', 'Sérgio', 'Tânia', 'Vinícius']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima', 'Gomes', 'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida', 'Lopes', 'Soares', 'Fernandes', 'Vieira', 'Barbosa', 'Rocha', 'Dias', 'Nascimento', 'Araújo', 'Moreira', 'Conceição', 'Mendes', 'Freitas', 'Cardoso', 'Teixeira']
+ESPECIALIDADES = ['Clínica Geral', 'Cardiologia', 'Dermatologia', 'Pediatria', 'Ortopedia', 'Psicologia', 'Nutrição', 'Fisioterapia', 'Ginecologia', 'Odontologia']
+CONVENIOS = ['Particular', 'Unimed', 'Bradesco Saúde', 'SulAmérica', 'Amil', 'Hapvida', 'NotreDame']
+SALAS = ['Sala 1', 'Sala 2', 'Sala 3', 'Sala 4', 'Consultório A', 'Consultório B']
+FRASES = ['Paciente relata dor há três dias, sem febre.', 'Pressão arterial dentro da normalidade.', 'Orientado a manter hidratação e repouso.', 'Retorno em 30 dias para reavaliação.', 'Exame físico sem alterações relevantes.', 'Solicitados exames laboratoriais de rotina.', 'Evolução favorável desde a última consulta.', 'Queixa de cefaleia frontal intermitente.']
+SLOTS_DIA = 20  # 08:00-18:00 em blocos de 30 min
+LOTE = 20000
+
+def nome(r): return f"{r.choice(NOMES)} {r.choice(SOBRENOMES)} {r.choice(SOBRENOMES)}"
+def cpf(r): d = f"{r.randrange(10**11):011d}"; return f"{d[:3]}.{d[3:6]}.{d[6:9]}-{d[9:]}"
+def tel(r): return f"({r.randint(11, 99)}) 9{r.randint(1000, 9999)}-{r.randint(1000, 9999)}"
+def texto(r, n): return ' '.join(r.choice(FRASES) for _ in range(n))
+
+def gravar(conn, sql, linhas, rotulo, total=None):
+    t0 = time.time(); n = 0; it = iter(linhas)
+    while True:
+        lote = list(itertools.islice(it, LOTE))
+        if not lote: break
+        conn.executemany(sql, lote); conn.commit(); n += len(lote)
+        print(f"\r  {rotulo}: {n}" + (f"/{total}" if total else ''), end='', flush=True)
+    print(f"\r  {rotulo}: {n} em {time.time() - t0:.1f}s" + ' ' * 20)
+    return n
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    p.add_argument('destino', help="arquivo .db a criar (não pode existir)")
+    p.add_argument('--pacientes', type=int, default=100000); p.add_argument('--agendamentos', type=int, default=2000000)
+    p.add_argument('--anos', type=float, default=5, help="histórico até hoje (mais 60 dias de agenda futura)")
+    p.add_argument('--profissionais', type=int, default=0, help="0 = o mínimo para caber os agendamentos na grade")
+    p.add_argument('--semente', type=int, default=42)
+    a = p.parse_args(); r = random.Random(a.semente)
+    destino = os.path.abspath(a.destino)
+    if os.path.exists(destino): sys.exit(f"{destino} já existe")
+
+    os.environ['CLINICA_DB'] = destino
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import backend
+    backend.db.iniciar()  # cria o schema completo e aplica as migrações no destino
+
+    conn = sqlite3.connect(destino); conn.execute("PRAGMA synchronous=OFF"); conn.execute("PRAGMA cache_size=-200000")
+    hoje = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    ini = hoje - timedelta(days=int(a.anos * 365)); fim = hoje + timedelta(days=60)
+    dias = [ini + timedelta(days=i) for i in range((fim - ini).days) if (ini + timedelta(days=i)).weekday() < 5]
+    profs = a.profissionais or max(1, math.ceil(a.agendamentos / (len(dias) * SLOTS_DIA * 0.85)))
+    print(f"Gerando em {destino}: {a.pacientes} pacientes, {profs} profissionais, ~{a.agendamentos} agendamentos, {len(dias)} dias úteis")
+
+    for t, itens in (('especialidades', ESPECIALIDADES), ('salas', SALAS)): conn.executemany(f"INSERT INTO {t} (nome) VALUES (?)", [(x,) for x in itens])
+    conn.executemany("INSERT INTO convenios (nome, prazo_pagamento) VALUES (?, ?)", [(c, r.choice([15, 30, 45])) for c in CONVENIOS]); conn.commit()
+    gravar(conn, "INSERT INTO profissionais (nome, crm, especialidade_id, email, telefone, cor_agenda, comissao, disponibilidade, ativo) VALUES (?,?,?,?,?,?,?,?,1)",
+           ((f"Dr(a). {nome(r)}", f"CRM-{r.randint(10000, 99999)}", r.randint(1, len(ESPECIALIDADES)), f"prof{i}@clinica.com", tel(r), '#10B981', r.choice([30, 40, 50]), '[]') for i in range(profs)), 'profissionais')
+    gravar(conn, "INSERT INTO pacientes (nome, cpf, data_nascimento, sexo, telefone_principal, email, convenio_id, observacoes_medicas, created_at) VALUES (?,?,?,?,?,?,?,?,?)",
+           ((nome(r), cpf(r), (hoje - timedelta(days=r.randint(365, 90 * 365))).strftime("%Y-%m-%d"), r.choice('MF'), tel(r), f"paciente{i}@email.com", r.randint(1, len(CONVENIOS)),
+             texto(r, r.randint(0, 3)), (ini + timedelta(days=r.randint(0, (hoje - ini).days))).strftime("%Y-%m-%d %H:%M:%S")) for i in range(a.pacientes)), 'pacientes', a.pacientes)
+
+    # Cada (dia, profissional) recebe k slots distintos da grade: nunca há sobreposição, como na agenda real
+    densidade = min(1.0, a.agendamentos / (len(dias) * profs * SLOTS_DIA))
+    def agendamentos():
+        for d in dias:
+            passado = d < hoje
+            for prof in range(1, profs + 1):
+                k = sum(1 for _ in range(SLOTS_DIA) if r.random() < densidade)
+                for s in r.sample(range(SLOTS_DIA), k):
+                    i = d + timedelta(minutes=480 + 30 * s); dur = 30
+                    st = r.choices(['Finalizado', 'Cancelado', 'NoShow', 'Realizado'], [80, 10, 5, 5])[0] if passado else r.choice(['Agendado', 'Confirmado'])
+                    yield (r.randint(1, a.pacientes), prof, i.strftime("%Y-%m-%d %H:%M:%S"), dur, (i + timedelta(minutes=dur)).strftime("%Y-%m-%d %H:%M:%S"), st, r.choice(['Consulta', 'Retorno', 'Exame']), r.randint(1, len(SALAS)))
+    gravar(conn, "INSERT INTO agendamentos (paciente_id, profissional_id, data_hora_inicio, duracao_minutos, data_hora_fim, status, tipo, sala_id) VALUES (?,?,?,?,?,?,?,?)", agendamentos(), 'agendamentos', a.agendamentos)
+    # O log de alterações da agenda só interessa para o que mudar daqui em diante
+    conn.execute("DELETE FROM agenda_log"); conn.commit()
+    leitor = sqlite3.connect(destino)  # lê em streaming por outra conexão enquanto a principal grava
+
+    def prontuarios():
+        for ag_id, pac, prof, dh in leitor.execute("SELECT id, paciente_id, profissional_id, data_hora_inicio FROM agendamentos WHERE status='Finalizado'"):
+            if r.random() < 0.6: yield (pac, prof, dh[:16], texto(r, r.randint(2, 8)), r.choice(['', 'J06.9', 'I10', 'E11', 'M54.5', 'F41.1']), texto(r, 1), r.choice(['', 'Hemograma completo', 'Glicemia de jejum']))
+    gravar(conn, "INSERT INTO prontuarios (paciente_id, profissional_id, data_atendimento, evolucao_clinica, diagnostico, prescricao, exames_solicitados) VALUES (?,?,?,?,?,?,?)", prontuarios(), 'prontuarios')
+
+    caixa = []
+    def receber():
+        for ag_id, pac, dh, st in leitor.execute("SELECT id, paciente_id, data_hora_inicio, status FROM agendamentos WHERE status IN ('Finalizado','Realizado','Agendado','Confirmado')"):
+            if r.random() >= 0.35: continue
+            v = float(r.choice([120, 150, 200, 250, 300, 450])); venc = dh[:10]; pago = venc < hoje.strftime("%Y-%m-%d") and r.random() < 0.9
+            if pago: caixa.append((venc + ' 12:00:00', 'Entrada', v, f"Baixa: Consulta {ag_id}", 'admin', ag_id))
+            yield (pac, f"Consulta {ag_id}", v, v if pago else 0, 'Pago' if pago else 'Pendente', venc, venc if pago else None, r.choice(['Pix', 'Cartão', 'Dinheiro', 'Convênio']), 'Consultas')
+    gravar(conn, "INSERT INTO contas_receber (paciente_id, descricao, valor_total, valor_pago, status, data_vencimento, data_pagamento, forma_pagamento, categoria) VALUES (?,?,?,?,?,?,?,?,?)", receber(), 'contas_receber')
+    def pagar():
+        m = ini.replace(day=1)
+        while m < fim:
+            for desc, cat, base in (('Aluguel', 'Fixo', 8000), ('Energia', 'Utilidades', 1200), ('Água', 'Utilidades', 300), ('Internet', 'Utilidades', 250), ('Material de consumo', 'Insumos', 2500), ('Folha de pagamento', 'Pessoal', 45000)):
+                venc = m.replace(day=10); v = round(base * r.uniform(0.9, 1.1), 2); pago = venc < hoje
+                if pago: caixa.append((venc.strftime("%Y-%m-%d") + ' 10:00:00', 'Saída', v, f"Baixa: {desc}", 'admin', None))
+                yield (f"Fornecedor {desc}", desc, v, v if pago else 0, 'Pago' if pago else 'Pendente', venc.strftime("%Y-%m-%d"), venc.strftime("%Y-%m-%d") if pago else None, 'Boleto', cat)
+            m = (m.replace(day=28) + timedelta(days=4)).replace(day=1)
+    gravar(conn, "INSERT INTO contas_pagar (fornecedor, descricao, valor_total, valor_pago, status, data_vencimento, data_pagamento, forma_pagamento, categoria) VALUES (?,?,?,?,?,?,?,?,?)", pagar(), 'contas_pagar')
+    caixa.sort(); gravar(conn, "INSERT INTO caixa (data_hora, tipo, valor, descricao, usuario, referencia_id) VALUES (?,?,?,?,?,?)", caixa, 'caixa')
+
+    # Sem ANALYZE aqui: as estatísticas ficam por conta do backend (atualizar_estatisticas), como numa base real que cresceu
+    leitor.close(); conn.commit(); conn.close()
+    print(f"Pronto: {os.path.getsize(destino) / 1024 / 1024:.0f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# O import já abre/migra o banco: aponta para um arquivo temporário para não tocar no clinica.db
+os.environ['CLINICA_DB'] = os.path.join(tempfile.mkdtemp(), 'clinica.db')
+os.environ.setdefault('CLINICA_SQL_LENTO_MS', '60000')  # as cargas em lote dos testes não vão para o consultas_lentas.log
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    banco = backend.Database(str(tmp_path / 'clinica.db'))
+    banco.iniciar()
+    monkeypatch.setattr(backend, 'db', banco)
+    yield banco
+    banco.pool.fechar_todas()
+
+
+@pytest.fixture
+def cliente(db):
+    c = backend.app.test_client()
+    assert c.post('/api/login', json={'username': 'admin', 'password': 'admin123'}).status_code == 200
+    return c
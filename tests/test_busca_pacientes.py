@@ -0,0 +1,51 @@
+import pytest
+
+import backend
+
+
+@pytest.fixture
+def cliente(cliente, db):
+    with db.conexao() as conn:
+        conn.executemany("INSERT INTO pacientes (nome, cpf, telefone_principal, email) VALUES (?,?,?,?)", [
+            ('Maria-Clara Souza', '111.222.333-44', '(11) 98765-4321', 'mc@exemplo.com'),
+            ("João D'Ávila", '555.666.777-88', '(21) 3333-2222', 'joao@exemplo.com'),
+            ('Ana Clara Lima', '999.888.777-66', '(31) 91234-5678', 'ana.clara@gmail.com'),
+        ])
+    return cliente
+
+
+def buscar(cliente, filtro):
+    r = cliente.get('/api/pacientes', query_string={'filtro': filtro})
+    assert r.status_code == 200
+    return sorted(p['nome'] for p in r.get_json())
+
+
+def test_termo_fts_separa_pontuacao_como_o_tokenizer():
+    assert backend.termo_fts('maria-clara') == '"maria clara"*'
+    assert backend.termo_fts("d'ávila") == '"d ávila"*'
+    assert backend.termo_fts('ana.clara@gmail.com') == '"ana clara gmail com"*'
+    assert backend.termo_fts('123.456.789-00 (11)') == '"12345678900"* "11"*'
+    assert backend.termo_fts('"maria" OR *') == '"maria"* "OR"*'
+    assert backend.termo_fts(' - ') == ''
+
+
+def test_busca_nome_com_hifen(cliente):
+    assert buscar(cliente, 'maria-clara') == ['Maria-Clara Souza']
+    assert buscar(cliente, 'maria-cl') == ['Maria-Clara Souza']
+
+
+def test_busca_nome_com_apostrofo(cliente):
+    assert buscar(cliente, "d'ávila") == ["João D'Ávila"]
+    assert buscar(cliente, "D'Avi") == ["João D'Ávila"]
+
+
+def test_busca_email(cliente):
+    assert buscar(cliente, 'ana.clara@gmail.com') == ['Ana Clara Lima']
+    assert buscar(cliente, 'ana.clara@gm') == ['Ana Clara Lima']
+
+
+def test_busca_cpf_e_telefone_mascarados(cliente):
+    assert buscar(cliente, '111.222.333-44') == ['Maria-Clara Souza']
+    assert buscar(cliente, '555.666') == ["João D'Ávila"]
+    assert buscar(cliente, '(31) 91234-5678') == ['Ana Clara Lima']
+    assert buscar(cliente, '91234-56') == ['Ana Clara Lima']
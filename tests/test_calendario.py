@@ -0,0 +1,43 @@
+import backend
+
+
+def agendar(conn, inicio, fim, status='Agendado'):
+    return conn.execute("INSERT INTO agendamentos (paciente_id, profissional_id, data_hora_inicio, data_hora_fim, duracao_minutos, status) VALUES (1, 1, ?, ?, 30, ?)",
+                        (inicio, fim, status)).lastrowid
+
+
+def ids(cliente, start, end):
+    r = cliente.get('/api/agenda/calendario', query_string={'start': start, 'end': end})
+    assert r.status_code == 200
+    return sorted(e['id'] for e in r.get_json())
+
+
+def test_janela_inclui_quem_comecou_antes_e_termina_dentro(cliente, db):
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO pacientes (nome) VALUES ('Ana')")
+        longo = agendar(conn, '2025-03-01 06:00:00', '2025-03-03 10:00:00')   # começou 2 dias antes da janela
+        dentro = agendar(conn, '2025-03-03 09:00:00', '2025-03-03 09:30:00')
+        agendar(conn, '2025-03-02 23:00:00', '2025-03-03 00:00:00')           # termina exatamente no início: fora
+        agendar(conn, '2025-03-04 00:00:00', '2025-03-04 00:30:00')           # começa exatamente no fim: fora
+        agendar(conn, '2025-03-03 11:00:00', '2025-03-03 11:30:00', 'Cancelado')
+    assert ids(cliente, '2025-03-03T00:00:00-03:00', '2025-03-04T00:00:00-03:00') == sorted([longo, dentro])
+
+
+def test_janela_fechada_no_indice_de_inicio(db):
+    with db.conexao() as conn:
+        agendar(conn, '2025-03-01 08:00:00', '2025-03-01 09:00:00')
+        piso = backend.inicio_minimo(conn, '2025-03-03 00:00:00')
+        assert piso == '2025-03-02 23:00:00'
+        plano = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN SELECT id FROM agendamentos a WHERE a.data_hora_fim > ? AND a.data_hora_inicio < ? AND a.data_hora_inicio > ?",
+                                            ('2025-03-03', '2025-03-04', piso))]
+        assert plano[0].startswith('SEARCH a USING INDEX idx_ag_inicio (data_hora_inicio>? AND data_hora_inicio<?)'), plano
+        assert backend.inicio_minimo(conn, 'não é data') is None
+
+
+def test_manutencao_poda_o_agenda_log(db, monkeypatch):
+    monkeypatch.setattr(backend, 'AGENDA_LOG_RETENCAO', 3)
+    with db.conexao() as conn:
+        for i in range(10): agendar(conn, f'2025-03-01 {8 + i:02d}:00:00', f'2025-03-01 {8 + i:02d}:30:00')
+    with db.conexao() as conn:
+        db.manutencao(conn)
+        assert conn.execute("SELECT COUNT(*) FROM agenda_log").fetchone()[0] == 3
@@ -0,0 +1,20 @@
+import backend
+
+
+def test_ip_rede_calculado_uma_vez(cliente, monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(backend, 'obter_ip_rede', lambda porta=5000: chamadas.append(porta) or 'http://10.0.0.5:5000')
+    monkeypatch.delitem(backend.app.config, 'IP_REDE', raising=False)
+    for _ in range(3):
+        assert cliente.get('/api/config').get_json()['ip_rede'] == 'http://10.0.0.5:5000'
+    assert len(chamadas) == 1
+
+
+def test_importar_o_modulo_nao_cria_banco(tmp_path):
+    # Modo --cliente: a estação só abre a janela, não pode ganhar um clinica.db local
+    caminho = tmp_path / 'estacao.db'
+    banco = backend.Database(str(caminho))
+    assert not caminho.exists()
+    banco.conectar().close()
+    assert caminho.exists()
+    banco.pool.fechar_todas()
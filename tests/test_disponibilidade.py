@@ -0,0 +1,104 @@
+from datetime import datetime, time, timedelta
+
+import pytest
+
+import backend
+
+# Segunda-feira daqui a ~2 semanas: dentro do horizonte do índice em memória e na grade padrão (seg-sex 08-18)
+SEG = (datetime.now() + timedelta(days=14 - datetime.now().weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+PASSADO = datetime(2020, 3, 2)  # também segunda; antes do horizonte, a checagem vai para o SQL
+
+
+def h(dia, hhmm):
+    return dia.replace(hour=int(hhmm[:2]), minute=int(hhmm[3:]))
+
+
+@pytest.fixture
+def agenda(db):
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO pacientes (nome) VALUES ('Ana')")
+        conn.execute("INSERT INTO profissionais (nome, ativo) VALUES ('Dra. Bia', 1)")
+    return db
+
+
+def marcar(db, ini, minutos, status='Agendado'):
+    fim = ini + timedelta(minutes=minutos)
+    with db.conexao() as conn:
+        return conn.execute("INSERT INTO agendamentos (paciente_id, profissional_id, data_hora_inicio, duracao_minutos, data_hora_fim, status) VALUES (1, 1, ?, ?, ?, ?)",
+                            (ini.strftime("%Y-%m-%d %H:%M:%S"), minutos, fim.strftime("%Y-%m-%d %H:%M:%S"), status)).lastrowid
+
+
+@pytest.mark.parametrize('dia', [SEG, PASSADO], ids=['memoria', 'sql'])
+def test_conflito_nas_bordas(agenda, dia):
+    ag = marcar(agenda, h(dia, '09:00'), 30)
+    c = agenda.agenda.conflito
+    assert c(1, h(dia, '08:30'), h(dia, '09:00')) is None      # termina quando o outro começa
+    assert c(1, h(dia, '09:30'), h(dia, '10:00')) is None      # começa quando o outro termina
+    assert c(1, h(dia, '08:45'), h(dia, '09:01')) == ag
+    assert c(1, h(dia, '09:29'), h(dia, '09:45')) == ag
+    assert c(1, h(dia, '08:00'), h(dia, '12:00')) == ag        # engloba
+    assert c(1, h(dia, '09:10'), h(dia, '09:20')) == ag        # contido
+    assert c(1, h(dia, '09:00'), h(dia, '09:30'), ignorar_id=ag) is None
+    assert c(2, h(dia, '09:00'), h(dia, '09:30')) is None      # outro profissional
+
+
+def test_indice_acompanha_o_agenda_log(agenda):
+    c = agenda.agenda.conflito
+    assert c(1, h(SEG, '10:00'), h(SEG, '10:30')) is None       # carga inicial
+    ag = marcar(agenda, h(SEG, '10:00'), 30)
+    assert c(1, h(SEG, '10:00'), h(SEG, '10:30')) == ag         # inserção
+    with agenda.conexao() as conn:
+        conn.execute("UPDATE agendamentos SET data_hora_inicio=?, data_hora_fim=? WHERE id=?", (h(SEG, '14:00').strftime("%Y-%m-%d %H:%M:%S"), h(SEG, '14:30').strftime("%Y-%m-%d %H:%M:%S"), ag))
+    assert c(1, h(SEG, '10:00'), h(SEG, '10:30')) is None       # mudou de horário: o antigo fica livre
+    assert c(1, h(SEG, '14:00'), h(SEG, '14:30')) == ag
+
+
+def test_transferencia_mantem_a_duracao(cliente, agenda):
+    ag = marcar(agenda, h(SEG, '09:00'), 60)
+    r = cliente.post('/api/agendamento/transferir', json={'id': ag, 'profissional_id': 1, 'data': SEG.strftime('%Y-%m-%d'), 'hora': '15:00'})
+    assert r.status_code == 200
+    with agenda.conexao() as conn:
+        fim = conn.execute("SELECT data_hora_fim FROM agendamentos WHERE id=?", (ag,)).fetchone()[0]
+    assert fim == h(SEG, '16:00').strftime("%Y-%m-%d %H:%M:%S")
+    assert agenda.agenda.conflito(1, h(SEG, '15:45'), h(SEG, '16:00')) == ag
+    assert agenda.agenda.conflito(1, h(SEG, '09:00'), h(SEG, '10:00')) is None
+    outro = marcar(agenda, h(SEG, '11:00'), 30)
+    r = cliente.post('/api/agendamento/transferir', json={'id': outro, 'profissional_id': 1, 'data': SEG.strftime('%Y-%m-%d'), 'hora': '15:30'})
+    assert r.status_code == 409
+
+
+@pytest.mark.parametrize('liberar', ['excluir', 'cancelar'])
+def test_horario_volta_a_ficar_livre(cliente, agenda, liberar):
+    ag = marcar(agenda, h(SEG, '08:00'), 30)
+    livres = lambda: [x['inicio'][11:16] for x in cliente.get('/api/disponibilidade', query_string={'prof_id': 1, 'data': SEG.strftime('%Y-%m-%d'), 'hora': '08:00', 'n': 2}).get_json()]
+    assert livres() == ['08:30', '09:00']
+    if liberar == 'excluir': assert cliente.delete(f'/api/agenda/deletar/{ag}').status_code == 200
+    else: assert cliente.post('/api/agenda/status', json={'id': ag, 'status': 'Cancelado'}).status_code == 200
+    assert livres() == ['08:00', '08:30']
+
+
+def test_proximos_livres_alinhados_a_grade(agenda):
+    grade = {0: [(time(8, 0), time(10, 0))]}
+    marcar(agenda, h(SEG, '08:00'), 45)                         # ocupa até 08:45: o próximo alinhado a 30 min é 09:00
+    livres = agenda.agenda.proximos_livres(1, grade, h(SEG, '08:00'), 30, 10, dias=1, passo=30)
+    assert [t.strftime('%H:%M') for t in livres] == ['09:00', '09:30']
+    # começar no meio do passo arredonda para cima; 60 min a partir das 09:00 cabe uma vez na janela
+    assert [t.strftime('%H:%M') for t in agenda.agenda.proximos_livres(1, grade, h(SEG, '08:50'), 60, 10, dias=1, passo=30)] == ['09:00']
+    # dia sem grade não tem horário; a semana seguinte tem
+    assert [t.strftime('%d %H:%M') for t in agenda.agenda.proximos_livres(1, grade, h(SEG, '10:00'), 30, 1, dias=8, passo=30)] == [(SEG + timedelta(days=7)).strftime('%d 08:00')]
+
+
+@pytest.mark.parametrize('qs', [{'data': 'xx'}, {'data': '2025-02-30'}, {'hora': '25:00'}, {'duracao': 0}, {'duracao': -30}])
+def test_disponibilidade_com_parametro_invalido_responde_400(cliente, agenda, qs):
+    assert cliente.get('/api/disponibilidade', query_string=qs).status_code == 400
+
+
+def test_livres_no_horario_sem_data_responde_400(cliente, agenda):
+    assert cliente.get('/api/disponibilidade/livres', query_string={'hora': '09:00'}).status_code == 400
+
+
+def test_dias_limitado(cliente, agenda, monkeypatch):
+    pedidos = []
+    monkeypatch.setattr(agenda.agenda, 'proximos_livres', lambda *a: pedidos.append(a[5]) or [])
+    assert cliente.get('/api/disponibilidade', query_string={'dias': 100000, 'n': 100000}).status_code == 200
+    assert pedidos == [backend.DISPONIBILIDADE_MAX_DIAS]
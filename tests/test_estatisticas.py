@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+import backend
+
+JANELA = ("SELECT a.id FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id "
+          "WHERE (a.status!='Cancelado' OR a.status IS NULL) AND a.data_hora_fim > ? AND a.data_hora_inicio < ?")
+MES = ("SELECT a.id FROM agendamentos a JOIN pacientes p ON a.paciente_id=p.id JOIN profissionais pr ON a.profissional_id=pr.id "
+       "WHERE a.data_hora_inicio >= ? AND a.data_hora_inicio < ? ORDER BY a.data_hora_inicio")
+
+
+def plano(conn, sql, params):
+    return [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def crescer(conn, pacientes=5000, agendamentos=20000):
+    rnd = random.Random(1)
+    conn.executemany("INSERT INTO profissionais (nome) VALUES (?)", [(f"Prof {i}",) for i in range(5)])
+    conn.executemany("INSERT INTO pacientes (nome) VALUES (?)", [(f"Paciente {i:05d}",) for i in range(pacientes)])
+    linhas = []
+    for i in range(agendamentos):
+        d = f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(8, 17):02d}:00:00"
+        linhas.append((rnd.randint(1, pacientes), rnd.randint(1, 5), d, d[:14] + '30:00', 'Agendado'))
+    conn.executemany("INSERT INTO agendamentos (paciente_id, profissional_id, data_hora_inicio, data_hora_fim, status) VALUES (?,?,?,?,?)", linhas)
+    conn.commit()
+
+
+@pytest.fixture
+def base_crescida(db):
+    # Estatísticas tiradas com a base pequena (como o ANALYZE que rodava na migração), depois a base cresce
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO pacientes (nome) VALUES ('Único')")
+        conn.execute("INSERT INTO agendamentos (paciente_id, profissional_id, data_hora_inicio, data_hora_fim) VALUES (1, 1, '2025-01-01 08:00:00', '2025-01-01 08:30:00')")
+        conn.commit(); conn.execute("ANALYZE")
+    conn = db.conectar(); crescer(conn)
+    yield conn
+    conn.close()
+
+
+def test_migracao_nao_grava_estatisticas(db):
+    with db.conexao() as conn:
+        tem = conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()
+        assert not tem or not conn.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl IN ('agendamentos', 'pacientes')").fetchone()[0]
+
+
+def test_estatisticas_refeitas_quando_a_base_cresce(db, base_crescida):
+    conn = base_crescida
+    assert {'pacientes', 'agendamentos'} <= set(db.atualizar_estatisticas(conn))
+    for sql, params in ((JANELA, ('2025-03-01', '2025-04-01')), (MES, ('2025-03-01', '2025-04-01'))):
+        p = plano(conn, sql, params)
+        assert p[0].startswith('SEARCH a USING INDEX'), p
+        assert not any(x.startswith('SCAN') for x in p), p
+    # sem mudança de tamanho, a próxima passada não refaz nada
+    assert db.atualizar_estatisticas(conn) == []
+
+
+def test_init_db_atualiza_estatisticas_velhas(db, base_crescida):
+    db.init_db()
+    n = base_crescida.execute("SELECT stat FROM sqlite_stat1 WHERE idx='idx_ag_inicio'").fetchone()[0]
+    assert int(n.split()[0]) > 10000
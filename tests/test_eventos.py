@@ -0,0 +1,17 @@
+import backend
+
+
+def test_stream_alem_do_limite_responde_503(cliente, monkeypatch):
+    monkeypatch.setattr(backend, 'SSE_DURACAO_MAX', 0)
+    backend.canal_agenda.limitar(1)
+    try:
+        aberto = cliente.get('/api/eventos/agenda')
+        assert aberto.status_code == 200 and aberto.mimetype == 'text/event-stream'
+        r = cliente.get('/api/eventos/agenda')
+        assert r.status_code == 503 and r.headers['Retry-After'] == '30'
+        aberto.close()  # fim do stream devolve a vaga
+        segundo = cliente.get('/api/eventos/agenda')
+        assert segundo.status_code == 200
+        segundo.close()
+    finally:
+        backend.canal_agenda.limitar(8)
@@ -0,0 +1,80 @@
+import pytest
+
+
+@pytest.mark.parametrize('corpo', ['null', '"texto"', '42', '{"itens": null}', '{"itens": "x"}'])
+def test_payload_que_nao_e_lista_responde_400(cliente, corpo):
+    r = cliente.post('/api/importar/pacientes', data=corpo, content_type='application/json')
+    assert r.status_code == 400
+    assert 'erro' in r.get_json()
+
+
+@pytest.mark.parametrize('tipo', ['pacientes', 'profissionais', 'agendamentos', 'financeiro'])
+def test_linha_que_nao_e_objeto_vira_erro_da_linha(cliente, tipo):
+    r = cliente.post(f'/api/importar/{tipo}?validar=1', json=['x', 3, None, []])
+    assert r.status_code == 200
+    d = r.get_json()
+    assert d['inseridos'] == 0
+    assert [e['linha'] for e in d['erros']] == [1, 2, 3, 4]
+
+
+def test_linhas_validas_seguem_com_as_invalidas_no_relatorio(cliente):
+    d = cliente.post('/api/importar/pacientes', json={'itens': [{'nome': 'Ana'}, 'x', {'cpf': '1'}]}).get_json()
+    assert d['inseridos'] == 1 and d['gravado']
+    assert [e['linha'] for e in d['erros']] == [2, 3]
+
+
+def importar(cliente, tipo, itens):
+    r = cliente.post(f'/api/importar/{tipo}', json=itens)
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def test_agendamentos_com_referencia_inexistente_nao_entram(cliente, db):
+    # recorrência inteira para um profissional que não existe: nada é gravado
+    d = importar(cliente, 'agendamentos', [{'paciente_id': 1, 'profissional_id': 1, 'data': '2030-01-07', 'hora': '09:00', 'repetir': 'semanal', 'vezes': 10}])
+    assert d['inseridos'] == 0
+    assert d['erros'] == [{'linha': 1, 'erro': 'paciente_id 1 não existe em pacientes'}]
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO pacientes (nome) VALUES ('Ana')")
+        conn.execute("INSERT INTO salas (nome) VALUES ('Sala 1')")
+    d = importar(cliente, 'agendamentos', [
+        {'paciente_id': 1, 'profissional_id': 7, 'data': '2030-01-07', 'hora': '09:00'},
+        {'paciente_id': '1', 'profissional_id': 1, 'data': '2030-01-07', 'hora': '09:00', 'sala_id': 9},
+    ])
+    assert d['inseridos'] == 0
+    assert d['erros'] == [{'linha': 1, 'erro': 'profissional_id 7 não existe em profissionais'},
+                          {'linha': 2, 'erro': 'profissional_id 1 não existe em profissionais'}]
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO profissionais (nome) VALUES ('Dra. Bia')")
+    d = importar(cliente, 'agendamentos', [
+        {'paciente_id': '1', 'profissional_id': 1, 'data': '2030-01-07', 'hora': '09:00', 'sala_id': 1},
+        {'paciente_id': 1, 'profissional_id': 1, 'data': '2030-01-07', 'hora': '10:00', 'sala_id': 9},
+    ])
+    assert d['inseridos'] == 1
+    assert d['erros'] == [{'linha': 2, 'erro': 'sala_id 9 não existe em salas'}]
+
+
+def test_pacientes_e_financeiro_checam_referencias(cliente, db):
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO convenios (nome) VALUES ('Unimed')")
+    d = importar(cliente, 'pacientes', [{'nome': 'Ana', 'conv': 1}, {'nome': 'Bia', 'conv': 5}, {'nome': 'Caio', 'conv': ''}])
+    assert d['inseridos'] == 2 and d['erros'] == [{'linha': 2, 'erro': 'conv 5 não existe em convenios'}]
+    d = importar(cliente, 'financeiro', [{'tipo': 'receber', 'valor': '100', 'venc': '2030-01-10', 'cat': 'Consultas', 'desc': 'x', 'paciente_id': 99}])
+    assert d['erros'] == [{'linha': 1, 'erro': 'paciente_id 99 não existe em pacientes'}]
+
+
+@pytest.mark.parametrize('tipo, item, erro', [
+    ('agendamentos', {'paciente_id': 'abc', 'profissional_id': 1, 'data': '2030-01-07', 'hora': '09:00'}, 'paciente_id deve ser um número inteiro (recebido: abc)'),
+    ('agendamentos', {'paciente_id': 1, 'profissional_id': 1, 'data': '07/01/2030', 'hora': '09:00'}, 'data/hora devem ser AAAA-MM-DD e HH:MM (recebido: 07/01/2030 09:00)'),
+    ('agendamentos', {'paciente_id': 1, 'profissional_id': 1, 'data': '2030-01-07', 'hora': '09:00', 'duracao': '0'}, 'duracao deve ser no mínimo 1 (recebido: 0)'),
+    ('agendamentos', {'paciente_id': 1, 'profissional_id': 1, 'data': '2030-01-07', 'hora': '09:00', 'repetir': 'semanal', 'vezes': 'dez'}, 'vezes deve ser um número inteiro (recebido: dez)'),
+    ('agendamentos', {'paciente_id': 1, 'profissional_id': 1, 'data': '2030-01-07', 'hora': '09:00', 'repetir': 'semanal', 'ate': 'logo'}, 'ate deve ser uma data AAAA-MM-DD (recebido: logo)'),
+    ('financeiro', {'tipo': 'pagar', 'valor': 'cem', 'venc': '2030-01-10', 'cat': 'x', 'desc': 'x'}, 'valor deve ser um valor numérico (recebido: cem)'),
+    ('financeiro', {'tipo': 'pagar', 'valor': '10', 'venc': '10/01/2030', 'cat': 'x', 'desc': 'x'}, 'venc deve ser uma data AAAA-MM-DD (recebido: 10/01/2030)'),
+    ('financeiro', {'tipo': 'pagar', 'valor': '10', 'venc': '2030-01-10', 'cat': 'x', 'desc': 'x', 'parc': 'duas'}, 'parc deve ser um número inteiro (recebido: duas)'),
+    ('financeiro', {'tipo': 'despesa', 'valor': '10', 'venc': '2030-01-10', 'cat': 'x', 'desc': 'x'}, 'tipo deve ser receber ou pagar (recebido: despesa)'),
+])
+def test_erros_de_campo_legiveis(cliente, db, tipo, item, erro):
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO pacientes (nome) VALUES ('Ana')"); conn.execute("INSERT INTO profissionais (nome) VALUES ('Dra. Bia')")
+    assert importar(cliente, tipo, [item])['erros'] == [{'linha': 1, 'erro': erro}]
@@ -0,0 +1,24 @@
+import pytest
+
+import backend
+
+
+def test_intervalo_dias_semiaberto():
+    assert backend.intervalo_dias('2024-01-01', '2024-01-31') == ('2024-01-01', '2024-02-01')
+
+
+@pytest.mark.parametrize('ini, fim', [('2024-01-01', ''), ('', '2024-01-31'), ('2024-01-01', None), ('2024-01-01', '31/01/2024')])
+def test_intervalo_dias_com_data_vazia_e_vazio(ini, fim):
+    a, b = backend.intervalo_dias(ini, fim)
+    assert a == b
+
+
+def test_agenda_com_fim_vazio_devolve_lista_vazia(cliente):
+    r = cliente.get('/api/agenda', query_string={'inicio': '2024-01-01', 'fim': ''})
+    assert r.status_code == 200 and r.get_json() == []
+
+
+@pytest.mark.parametrize('tipo', ['agendamentos', 'financeiro', 'profissionais', 'pacientes', 'convenios', 'aniversariantes'])
+def test_relatorio_com_fim_vazio_nao_quebra(cliente, tipo):
+    r = cliente.post('/api/relatorios/gerar', json={'tipo': tipo, 'inicio': '2024-01-01', 'fim': ''})
+    assert r.status_code == 200 and r.get_json() == []
@@ -0,0 +1,99 @@
+import gzip
+import json
+
+import pytest
+from flask import Response
+
+import backend
+
+
+def paginas(cliente, url, limite, **qs):
+    """Percorre o X-Proximo-Cursor até o fim; devolve todas as linhas na ordem recebida."""
+    linhas, cursor = [], None
+    while True:
+        r = cliente.get(url, query_string=dict(qs, limit=limite, **({'cursor': cursor} if cursor else {})))
+        assert r.status_code == 200
+        linhas += r.get_json(); cursor = r.headers.get('X-Proximo-Cursor')
+        if not cursor: return linhas
+
+
+def test_cursor_com_nomes_repetidos(cliente, db):
+    with db.conexao() as conn:
+        conn.executemany("INSERT INTO profissionais (nome) VALUES (?)", [('Dra. Ana',)] * 5 + [('Dr. Beto',)] * 3 + [('Dra. Carla',)])
+    todas = paginas(cliente, '/api/profissionais', 2)
+    assert [(p['nome'], p['id']) for p in todas] == sorted((p['nome'], p['id']) for p in todas)
+    assert len({p['id'] for p in todas}) == len(todas) == 9
+
+
+def test_cursor_com_vencimentos_iguais(cliente, db):
+    with db.conexao() as conn:
+        conn.executemany("INSERT INTO contas_receber (descricao, valor_total, data_vencimento) VALUES (?,?,?)",
+                         [(f'c{i}', 10, '2030-01-10' if i % 3 else '2030-01-05') for i in range(10)])
+    todas = paginas(cliente, '/api/financeiro/receber', 3)
+    assert [(c['data_vencimento'], c['id']) for c in todas] == sorted((c['data_vencimento'], c['id']) for c in todas)
+    assert len({c['id'] for c in todas}) == 10
+
+
+def test_prontuario_do_mais_recente_para_o_mais_antigo(cliente, db):
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO profissionais (nome) VALUES ('Dra. Ana')")
+        conn.executemany("INSERT INTO prontuarios (paciente_id, profissional_id, data_atendimento, evolucao_clinica) VALUES (1, 1, ?, ?)",
+                         [(d, f'e{i}') for i, d in enumerate(['2030-01-01 09:00', '2030-02-01 09:00', '2030-02-01 09:00', '2030-01-15 10:00', '2030-02-01 09:00'])])
+        conn.execute("INSERT INTO prontuarios (paciente_id, profissional_id, data_atendimento) VALUES (2, 1, '2030-03-01 09:00')")
+    todas = paginas(cliente, '/api/prontuario/1', 2)
+    assert [(p['data_atendimento'], p['id']) for p in todas] == [('2030-02-01 09:00', 5), ('2030-02-01 09:00', 3), ('2030-02-01 09:00', 2),
+                                                                ('2030-01-15 10:00', 4), ('2030-01-01 09:00', 1)]
+    assert todas[0]['profissional'] == 'Dra. Ana'
+
+
+def test_campos_so_da_whitelist(cliente, db):
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO profissionais (nome, crm) VALUES ('Dra. Ana', '123')")
+    r = cliente.get('/api/profissionais', query_string={'campos': 'nome,esp_nome,password_hash,1;DROP TABLE x'})
+    assert r.get_json() == [{'nome': 'Dra. Ana', 'esp_nome': None}]
+    # nenhum campo válido: volta a projeção completa
+    assert {'id', 'nome', 'crm', 'esp_nome'} <= set(cliente.get('/api/profissionais', query_string={'campos': 'nada'}).get_json()[0])
+
+
+def test_if_none_match_responde_304(cliente, db):
+    r = cliente.get('/api/auxiliares/salas')
+    tag = r.headers['ETag']
+    assert tag.startswith('W/') and r.headers['Cache-Control'] == 'private, no-cache'
+    r304 = cliente.get('/api/auxiliares/salas', headers={'If-None-Match': tag})
+    assert r304.status_code == 304 and r304.data == b''
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO salas (nome) VALUES ('Sala 1')")
+    assert cliente.get('/api/auxiliares/salas', headers={'If-None-Match': tag}).status_code == 200
+
+
+def test_compressao_so_acima_de_1kb(cliente, db):
+    pequeno = cliente.get('/api/auxiliares/salas', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in pequeno.headers and 'Accept-Encoding' in pequeno.headers['Vary']
+    with db.conexao() as conn:
+        conn.executemany("INSERT INTO salas (nome) VALUES (?)", [(f'Sala {i:03d}',) for i in range(100)])
+    grande = cliente.get('/api/auxiliares/salas', headers={'Accept-Encoding': 'gzip'})
+    assert grande.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(grande.data))) == 100
+    assert 'Content-Encoding' not in cliente.get('/api/auxiliares/salas').headers   # cliente que não aceita gzip
+
+
+def test_calendario_etag_fraca_e_304_com_e_sem_compressao(cliente, db):
+    with db.conexao() as conn:
+        conn.execute("INSERT INTO pacientes (nome) VALUES ('Ana')")
+        conn.executemany("INSERT INTO agendamentos (paciente_id, profissional_id, data_hora_inicio, data_hora_fim, status) VALUES (1, 1, ?, ?, 'Agendado')",
+                         [(f'2030-01-{d:02d} 09:00:00', f'2030-01-{d:02d} 09:30:00') for d in range(1, 29)])
+    qs = {'start': '2030-01-01T00:00:00', 'end': '2030-02-01T00:00:00'}
+    z = cliente.get('/api/agenda/calendario', query_string=qs, headers={'Accept-Encoding': 'gzip'})
+    assert z.headers['Content-Encoding'] == 'gzip' and z.headers['ETag'].startswith('W/')
+    for enc in ('gzip', 'identity'):
+        assert cliente.get('/api/agenda/calendario', query_string=qs, headers={'Accept-Encoding': enc, 'If-None-Match': z.headers['ETag']}).status_code == 304
+
+
+def test_etag_forte_vira_fraca_ao_comprimir():
+    with backend.app.test_request_context('/api/x', headers={'Accept-Encoding': 'gzip'}):
+        resp = Response('x' * 2000, mimetype='application/json'); resp.set_etag('abc')
+        resp = backend.etag_e_compressao(resp)
+        assert resp.headers['Content-Encoding'] == 'gzip' and resp.get_etag() == ('abc', True)
+    with backend.app.test_request_context('/api/x'):
+        resp = Response('x' * 2000, mimetype='application/json'); resp.set_etag('abc')
+        assert backend.etag_e_compressao(resp).get_etag() == ('abc', False)
@@ -0,0 +1,29 @@
+import backend
+
+
+def contagem_sql(rota):
+    linha = next(l for l in backend.metricas.prometheus().splitlines() if l.startswith(f'clinica_sql_duration_seconds_count{{rota="{rota}"}}'))
+    return int(linha.split()[-1])
+
+
+def test_statement_conta_uma_vez_com_o_tempo_do_fetch(cliente, monkeypatch):
+    monkeypatch.setattr(backend, 'metricas', backend.Metricas())
+    assert cliente.get('/api/sala_espera').status_code == 200
+    top = backend.metricas.resumo_sql()['top']
+    assert contagem_sql('/api/sala_espera') == len(top)  # a consulta da sala e, se houver, a do load_user
+    assert all(c['qtd'] == 1 for c in top)
+
+
+def test_cursor_reaproveitado_fecha_a_medicao_anterior(db, monkeypatch):
+    monkeypatch.setattr(backend, 'metricas', backend.Metricas())
+    with db.conexao() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1").fetchall()
+        cur.execute("SELECT 2").fetchone()
+        cur.close()
+    assert {c['sql']: c['qtd'] for c in backend.metricas.resumo_sql()['top']} == {'SELECT 1': 1, 'SELECT 2': 1}
+
+
+def test_rota_metrics_sql(cliente):
+    d = cliente.get('/api/metrics/sql').get_json()
+    assert set(d) == {'lentas', 'top', 'limite_ms'} and d['top']
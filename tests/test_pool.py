@@ -0,0 +1,19 @@
+import threading
+
+
+def rajada(db, n):
+    pronto = threading.Barrier(n)
+    def req():
+        conn = db.conectar(); pronto.wait(); conn.execute("SELECT 1").fetchone(); conn.close()
+    ts = [threading.Thread(target=req) for _ in range(n)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+
+
+def test_pool_do_tamanho_das_threads_reaproveita_as_conexoes(db, monkeypatch):
+    abertas = []
+    nova = db.pool._nova
+    monkeypatch.setattr(db.pool, '_nova', lambda: abertas.append(1) or nova())
+    db.pool.redimensionar(16)
+    for _ in range(5): rajada(db, 16)
+    assert len(abertas) <= 16 and len(db.pool._todas) == 16